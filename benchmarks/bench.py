@@ -0,0 +1,469 @@
+"""
+Benchmark every endpoint of the API against a SQLite database seeded with synthetic data.
+
+    pipenv run bench --scale 10000                      # flask test client, one request at a time
+    pipenv run bench --scale 10000 --gunicorn -c 16     # real gunicorn process driven over HTTP
+    pipenv run bench --scale 10000 --asgi -c 1000       # gunicorn with uvicorn workers serving src/asgi.py
+    FAVORITES_GROUP_COMMIT_MS=5 pipenv run bench --gunicorn -c 64 --threads 32 --only "(add|delete)_fav"
+    pipenv run bench --compare benchmarks/results/a.json benchmarks/results/b.json
+
+--scale is the number of users, characters and planets (1k to 10M); every user gets
+--favorites favorite characters and planets. The seeded database is reused by later runs
+with the same scale, favorites and migration head (a new migration seeds it again). Results (throughput, p50/p99 latency, bytes and CPU per request, peak RSS) are saved as JSON.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import re
+import resource
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+MIGRATIONS = os.path.join(ROOT, "migrations")
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+
+GENDERS = ("male", "female", "n/a")
+COLORS = ("blue", "brown", "red", "yellow", "black", "green")
+NAMES = ("Luke", "Leia", "Han", "Anakin", "Padme", "Obi-Wan", "Yoda", "Lando", "Rey", "Finn", "Poe", "Ahsoka")
+PLANETS = ("Tatooine", "Alderaan", "Hoth", "Dagobah", "Bespin", "Endor", "Naboo", "Coruscant", "Kamino", "Jakku")
+
+
+def database_path(scale):
+    return "/tmp/bench-%d.db" % scale
+
+
+def chunked_insert(connection, sql, rows, size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            connection.executemany(sql, batch)
+            batch = []
+    if batch:
+        connection.executemany(sql, batch)
+
+
+def migrations_head():
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory(MIGRATIONS).get_current_head()
+
+
+def seed(scale, favorites):
+    # schema from the real migrations (FTS tables and indexes included), rows with executemany
+    path = database_path(scale)
+    if os.path.exists(path):
+        os.remove(path)
+    from flask_migrate import upgrade
+    from app import app
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+    connection = sqlite3.connect(path)
+    chunked_insert(connection, "INSERT INTO user (id, name, lastname, email, password, is_active) VALUES (?, ?, ?, ?, ?, 1)",
+        ((i, NAMES[i % len(NAMES)], "Bench", "user%d@bench.test" % i, "secret") for i in range(1, scale + 1)))
+    chunked_insert(connection, "INSERT INTO characters (id, name, birthday_year, gender, height, skin_color, eye_color) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((i, "%s %d" % (NAMES[i % len(NAMES)], i), i % 1000, GENDERS[i % 3], 100 + i % 120, COLORS[i % 6], COLORS[(i // 6) % 6])
+            for i in range(1, scale + 1)))
+    chunked_insert(connection, "INSERT INTO planets (id, name, diameter, rotation_period, orbital_period) VALUES (?, ?, ?, ?, ?)",
+        ((i, "%s %d" % (PLANETS[i % len(PLANETS)], i), (i * 7919) % 200000, i % 100, i % 1000) for i in range(1, scale + 1)))
+    chunked_insert(connection, "INSERT INTO fav__characters (user_id, character_id) VALUES (?, ?)",
+        ((user, (user - 1 + j) % scale + 1) for user in range(1, scale + 1) for j in range(min(favorites, scale))))
+    chunked_insert(connection, "INSERT INTO fav__planets (user_id, planet_id) VALUES (?, ?)",
+        ((user, (user - 1 + j) % scale + 1) for user in range(1, scale + 1) for j in range(min(favorites, scale))))
+    # the migrations created the favorite counters empty, fill them like `flask reconcile-popularity`
+    connection.execute("INSERT INTO popular__characters (character_id, favorites) "
+        "SELECT character_id, COUNT(*) FROM fav__characters GROUP BY character_id")
+    connection.execute("INSERT INTO popular__planets (planet_id, favorites) "
+        "SELECT planet_id, COUNT(*) FROM fav__planets GROUP BY planet_id")
+    connection.execute("INSERT INTO characters_fts(characters_fts) VALUES ('rebuild')")
+    connection.execute("INSERT INTO planets_fts(planets_fts) VALUES ('rebuild')")
+    connection.execute("CREATE TABLE bench_meta (scale INTEGER, favorites INTEGER, revision TEXT)")
+    connection.execute("INSERT INTO bench_meta VALUES (?, ?, ?)", (scale, favorites, migrations_head()))
+    connection.commit()
+    connection.close()
+
+
+def is_seeded(scale, favorites):
+    path = database_path(scale)
+    if not os.path.exists(path):
+        return False
+    try:
+        connection = sqlite3.connect(path)
+        row = connection.execute("SELECT scale, favorites, revision FROM bench_meta").fetchone()
+        connection.close()
+    except sqlite3.Error:
+        # seeded before bench_meta had the revision
+        return False
+    # seeded at an older commit the database may lack tables, every request to them would fail
+    return row == (scale, favorites, migrations_head())
+
+
+def bench_ids(scale, table, per_request=1):
+    # rows created by the write scenarios, so the delete scenarios have something to delete;
+    # returns a setup function that also limits the requests to the rows there are
+    def setup(state):
+        connection = sqlite3.connect(database_path(scale))
+        ids = [row[0] for row in connection.execute("SELECT id FROM %s WHERE name LIKE 'bench-%%' ORDER BY id" % table)]
+        connection.close()
+        state["ids"] = ids
+        state["limit"] = -(-len(ids) // per_request)
+    return setup
+
+
+def character(i):
+    return {"name": "bench-%d" % i, "birthday_year": 19, "gender": "male", "height": 172, "skin_color": "fair", "eye_color": "blue"}
+
+
+def planet(i):
+    return {"name": "bench-%d" % i, "diameter": 10465, "rotation_period": 23, "orbital_period": 304}
+
+
+def request_method(method, i):
+    # mixed scenarios pick the method per request
+    return method(i) if callable(method) else method
+
+
+def scenarios(scale):
+    """(name, method, path(i, state), body(i, state), setup(state)) for every route; reads first, then writes."""
+    middle = scale // 2
+    # the page scenarios read the first, a middle and the last 100 rows, keyset pages cost the same at any depth
+    last = max(scale - 100, 0)
+    one = lambda i: i % scale + 1
+    return [
+        ("sitemap", "GET", lambda i, s: "/", None, None),
+        ("users_list", "GET", lambda i, s: "/user", None, None),
+        ("users_page_first", "GET", lambda i, s: "/user?limit=100", None, None),
+        ("users_page", "GET", lambda i, s: "/user?limit=100&after=%d" % middle, None, None),
+        ("users_page_last", "GET", lambda i, s: "/user?limit=100&after=%d" % last, None, None),
+        ("user", "GET", lambda i, s: "/user/%d" % one(i), None, None),
+        ("people_list", "GET", lambda i, s: "/people", None, None),
+        ("people_page_first", "GET", lambda i, s: "/people?limit=100", None, None),
+        ("people_page", "GET", lambda i, s: "/people?limit=100&after=%d" % middle, None, None),
+        ("people_page_last", "GET", lambda i, s: "/people?limit=100&after=%d" % last, None, None),
+        ("people_filtered", "GET", lambda i, s: "/people?fields=name&filter[gender]=female&filter[eye_color]=blue", None, None),
+        ("people_sorted", "GET", lambda i, s: "/people?sort=-height,name&fields=name,height", None, None),
+        ("people_stream", "GET", lambda i, s: "/people?stream=1", None, None),
+        ("person", "GET", lambda i, s: "/people/%d" % one(i), None, None),
+        ("planets_list", "GET", lambda i, s: "/planets", None, None),
+        ("planets_page_first", "GET", lambda i, s: "/planets?limit=100", None, None),
+        ("planets_page", "GET", lambda i, s: "/planets?limit=100&after=%d" % middle, None, None),
+        ("planets_page_last", "GET", lambda i, s: "/planets?limit=100&after=%d" % last, None, None),
+        ("planets_sorted", "GET", lambda i, s: "/planets?sort=-diameter&fields=name,diameter", None, None),
+        ("planets_stream", "GET", lambda i, s: "/planets?stream=1", None, None),
+        ("planet", "GET", lambda i, s: "/planets/%d" % one(i), None, None),
+        ("dashboard", "GET", lambda i, s: "/user/%d/dashboard" % one(i), None, None),
+        ("fav_characters", "GET", lambda i, s: "/user/%d/fav_characters" % one(i), None, None),
+        ("fav_characters_expanded", "GET", lambda i, s: "/user/%d/fav_characters?expand=1" % one(i), None, None),
+        ("fav_planets", "GET", lambda i, s: "/user/%d/fav_planets" % one(i), None, None),
+        ("fav_planets_expanded", "GET", lambda i, s: "/user/%d/fav_planets?expand=1" % one(i), None, None),
+        ("people_top", "GET", lambda i, s: "/people/top?limit=10", None, None),
+        ("planets_top", "GET", lambda i, s: "/planets/top?limit=10", None, None),
+        ("search", "GET", lambda i, s: "/search?q=%s" % NAMES[i % len(NAMES)][:3], None, None),
+        ("pool_metrics", "GET", lambda i, s: "/metrics/pool", None, None),
+        ("create_person", "POST", lambda i, s: "/people", lambda i, s: character(i), None),
+        ("create_planet", "POST", lambda i, s: "/planets", lambda i, s: planet(i), None),
+        ("modify_person", "PUT", lambda i, s: "/people/%d" % one(i), lambda i, s: {"skin_color": "green"}, None),
+        ("modify_planet", "PUT", lambda i, s: "/planets/%d" % one(i), lambda i, s: {"diameter": 12000}, None),
+        # one write every four requests, readers and writers on the same rows
+        ("mixed_people", lambda i: "PUT" if i % 4 == 0 else "GET", lambda i, s: "/people/%d" % one(i // 4),
+            lambda i, s: {"skin_color": "green"} if i % 4 == 0 else None, None),
+        ("mixed_planets", lambda i: "PUT" if i % 4 == 0 else "GET", lambda i, s: "/planets/%d" % one(i // 4),
+            lambda i, s: {"diameter": 12000} if i % 4 == 0 else None, None),
+        ("add_fav_character", "POST", lambda i, s: "/user/%d/fav_characters" % one(i),
+            lambda i, s: {"id_character": one(i * 7 + middle)}, None),
+        ("delete_fav_character", "DELETE", lambda i, s: "/user/%d/fav_characters" % one(i),
+            lambda i, s: {"id_character": one(i * 7 + middle)}, None),
+        ("add_fav_planet", "POST", lambda i, s: "/user/%d/fav_planets" % one(i),
+            lambda i, s: {"id_planet": one(i * 7 + middle)}, None),
+        ("delete_fav_planet", "DELETE", lambda i, s: "/user/%d/fav_planets" % one(i),
+            lambda i, s: {"id_planet": one(i * 7 + middle)}, None),
+        ("delete_person", "DELETE", lambda i, s: "/people/%d" % s["ids"][i % len(s["ids"])], None,
+            bench_ids(scale, "characters")),
+        ("delete_planet", "DELETE", lambda i, s: "/planets/%d" % s["ids"][i % len(s["ids"])], None,
+            bench_ids(scale, "planets")),
+        ("bulk_create_people", "POST", lambda i, s: "/people/bulk", lambda i, s: [character(i * 100 + j) for j in range(100)], None),
+        ("bulk_update_people", "PUT", lambda i, s: "/people/bulk",
+            lambda i, s: [{"id": one(i * 100 + j), "eye_color": "red"} for j in range(100)], None),
+        ("bulk_delete_people", "DELETE", lambda i, s: "/people/bulk", lambda i, s: s["ids"][i * 100:(i + 1) * 100],
+            bench_ids(scale, "characters", 100)),
+        ("bulk_create_planets", "POST", lambda i, s: "/planets/bulk", lambda i, s: [planet(i * 100 + j) for j in range(100)], None),
+        ("bulk_update_planets", "PUT", lambda i, s: "/planets/bulk",
+            lambda i, s: [{"id": one(i * 100 + j), "orbital_period": 365} for j in range(100)], None),
+        ("bulk_delete_planets", "DELETE", lambda i, s: "/planets/bulk", lambda i, s: s["ids"][i * 100:(i + 1) * 100],
+            bench_ids(scale, "planets", 100)),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, errors, seconds, body_bytes, cpu_seconds):
+    # bytes are the response bodies as sent (compressed when --encoding is given); cpu is the server's
+    # user+system time, in test client mode that includes the client
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "rps": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "bytes_per_request": round(body_bytes / len(latencies)) if latencies else None,
+        "cpu_ms_per_request": round(cpu_seconds * 1000 / len(latencies), 3) if latencies else None,
+    }
+
+
+def run_test_client(selected, requests, encoding):
+    from app import app
+    client = app.test_client()
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    results = {}
+    for name, method, path, body, setup in selected:
+        state = {}
+        if setup:
+            setup(state)
+        latencies = []
+        errors = 0
+        body_bytes = 0
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for i in range(min(requests, state.get("limit", requests))):
+            begin = time.perf_counter()
+            response = client.open(path(i, state), method=request_method(method, i), json=body(i, state) if body else None,
+                headers=headers)
+            # read the whole body, streamed responses included
+            body_bytes += len(response.get_data())
+            latencies.append(time.perf_counter() - begin)
+            if response.status_code >= 400:
+                errors += 1
+        results[name] = summarize(latencies, errors, time.perf_counter() - start, body_bytes,
+            time.process_time() - cpu_start)
+        print("%-26s %s" % (name, results[name]), flush=True)
+    return results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/%s/stat" % entry) as file:
+                    if int(file.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def peak_rss_kb(pid):
+    # VmHWM is the peak resident set of each process; master + workers
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open("/proc/%d/status" % child) as file:
+                match = re.search(r"VmHWM:\s+(\d+) kB", file.read())
+        except OSError:
+            continue
+        if match:
+            total += int(match.group(1))
+    return total
+
+
+def cpu_seconds(pid):
+    # utime + stime of master and workers
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open("/proc/%d/stat" % child) as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def http_request(port, method, path, body, encoding=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        payload = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if encoding:
+            headers["Accept-Encoding"] = encoding
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        return response.status, len(response.read())
+    finally:
+        connection.close()
+
+
+def run_gunicorn(selected, requests, concurrency, workers, threads, encoding, env, asgi=False):
+    port = free_port()
+    # the ASGI app answers every connection from one event loop per worker, --threads does not apply
+    application = ["asgi:application", "-k", "uvicorn.workers.UvicornWorker"] if asgi else ["wsgi", "--threads", str(threads)]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn"] + application + ["--chdir", SRC, "-b", "127.0.0.1:%d" % port,
+            "-w", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                http_request(port, "GET", "/metrics/pool", None)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+        results = {}
+        with ThreadPoolExecutor(concurrency) as executor:
+            for name, method, path, body, setup in selected:
+                state = {}
+                if setup:
+                    setup(state)
+
+                def one(i):
+                    begin = time.perf_counter()
+                    status, size = http_request(port, request_method(method, i), path(i, state),
+                        body(i, state) if body else None, encoding)
+                    return time.perf_counter() - begin, status, size
+
+                start = time.perf_counter()
+                cpu_start = cpu_seconds(server.pid)
+                outcomes = list(executor.map(one, range(min(requests, state.get("limit", requests)))))
+                seconds = time.perf_counter() - start
+                results[name] = summarize([latency for latency, status, size in outcomes],
+                    sum(1 for latency, status, size in outcomes if status >= 400), seconds,
+                    sum(size for latency, status, size in outcomes), cpu_seconds(server.pid) - cpu_start)
+                print("%-26s %s" % (name, results[name]), flush=True)
+        return results, peak_rss_kb(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    regressions = 0
+    print("%-26s %12s %12s %12s %12s %12s %12s %10s %10s" % ("scenario", "old rps", "new rps", "old p99 ms", "new p99 ms",
+        "old bytes", "new bytes", "old cpu", "new cpu"))
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        flag = ""
+        if before["p99_ms"] and result["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + threshold):
+            flag = "  <-- slower"
+            regressions += 1
+        print("%-26s %12s %12s %12s %12s %12s %12s %10s %10s%s" % (name, before["rps"], result["rps"], before["p99_ms"],
+            result["p99_ms"], before.get("bytes_per_request"), result.get("bytes_per_request"),
+            before.get("cpu_ms_per_request"), result.get("cpu_ms_per_request"), flag))
+    print("peak rss kb: %s -> %s" % (old.get("peak_rss_kb"), new.get("peak_rss_kb")))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1000, help="users, characters and planets to seed")
+    parser.add_argument("--favorites", type=int, default=5, help="favorite characters and planets per user")
+    parser.add_argument("--requests", "-n", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--only", help="regex, run only the scenarios whose name matches")
+    parser.add_argument("--reseed", action="store_true", help="seed again even if the database exists")
+    parser.add_argument("--gunicorn", action="store_true", help="run a real gunicorn and use HTTP")
+    parser.add_argument("--asgi", action="store_true", help="like --gunicorn, serving asgi:application with uvicorn workers")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="concurrent clients (gunicorn mode)")
+    parser.add_argument("--workers", "-w", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="threads per gunicorn worker")
+    parser.add_argument("--encoding", help="Accept-Encoding sent with every request, e.g. gzip, br or zstd")
+    parser.add_argument("--output", "-o", help="where to save the results (default benchmarks/results/<date>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p99 increase reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    # the app reads its configuration on import, so the environment goes first
+    os.environ["DATABASE_URL"] = "sqlite:///" + database_path(args.scale)
+    sys.path.insert(0, SRC)
+
+    if args.reseed or not is_seeded(args.scale, args.favorites):
+        start = time.perf_counter()
+        seed(args.scale, args.favorites)
+        print("seeded %d rows per table in %.1fs" % (args.scale, time.perf_counter() - start), flush=True)
+
+    # WAL is stored in the database file, put it back when comparing against SQLITE_TUNING=0
+    connection = sqlite3.connect(database_path(args.scale))
+    connection.execute("PRAGMA journal_mode = %s" % ("DELETE" if os.getenv("SQLITE_TUNING", "1") == "0" else "WAL"))
+    connection.close()
+
+    selected = scenarios(args.scale)
+    if args.only:
+        selected = [scenario for scenario in selected if re.search(args.only, scenario[0])]
+
+    if args.asgi:
+        args.gunicorn = True
+    if args.gunicorn:
+        results, rss = run_gunicorn(selected, args.requests, args.concurrency, args.workers, args.threads, args.encoding,
+            dict(os.environ), args.asgi)
+    else:
+        results, rss = run_test_client(selected, args.requests, args.encoding)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "mode": ("asgi" if args.asgi else "gunicorn") if args.gunicorn else "test_client",
+            "scale": args.scale,
+            "favorites": args.favorites,
+            "requests": args.requests,
+            "concurrency": args.concurrency if args.gunicorn else 1,
+            "workers": args.workers if args.gunicorn else None,
+            "threads": args.threads if args.gunicorn and not args.asgi else None,
+            "favorites_group_commit_ms": float(os.getenv("FAVORITES_GROUP_COMMIT_MS", 0)),
+            "sqlite_tuning": os.getenv("SQLITE_TUNING", "1") == "1",
+            "encoding": args.encoding,
+            "python": platform.python_version(),
+        },
+        "peak_rss_kb": rss,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, "%s-%s-%d.json" % (
+        datetime.now().strftime("%Y%m%d-%H%M%S"), report["meta"]["mode"], args.scale))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("results saved in %s" % output)
+
+
+if __name__ == "__main__":
+    main()
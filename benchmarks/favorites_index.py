@@ -0,0 +1,141 @@
+"""
+Query plans and latency of the favorites lookups without and with the unique (user_id, character_id) /
+(user_id, planet_id) indexes of migration b3d91f5c2a7e.
+
+    pipenv run python benchmarks/favorites_index.py --scale 1000000 --favorites 10   # 10M favorites per table
+
+For the statements GET and DELETE /user/<id>/fav_characters and /fav_planets run, it prints the
+EXPLAIN QUERY PLAN and times them straight on SQLite, then runs bench.py on the same database for
+the favorites GET/DELETE scenarios: first with the indexes dropped, then with them built again.
+Results are saved as JSON next to the bench.py ones.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench import RESULTS, SRC, database_path, git_commit, is_seeded, seed
+
+INDEXES = ("ix_fav__characters_user_id_character_id", "ix_fav__planets_user_id_planet_id")
+SCENARIOS = "^(fav_characters|fav_planets|delete_fav_character|delete_fav_planet)$"
+
+
+def lookups():
+    # the same statements the favorites handlers run, compiled for sqlite: name -> (sql, parameters(user))
+    from sqlalchemy import select
+    from models import Fav_Characters, Fav_Planets
+    statements = {}
+    for name, model, column in (("characters", Fav_Characters, "character_id"), ("planets", Fav_Planets, "planet_id")):
+        by_user = select(model).where(model.user_id == 0)
+        one = select(model).where(model.user_id == 0, getattr(model, column) == 0).limit(1)
+        statements["get_fav_" + name] = compile_lookup(by_user)
+        statements["delete_fav_" + name] = compile_lookup(one)
+    return statements
+
+
+def compile_lookup(statement):
+    from sqlalchemy.dialects import sqlite
+    compiled = statement.compile(dialect=sqlite.dialect())
+
+    def parameters(user):
+        # bench.py seeds user u with the favorites u, u+1..., so (u, u) is a favorite that exists
+        return tuple(user if name.startswith(("user_id", "character_id", "planet_id")) else compiled.params[name]
+            for name in compiled.positiontup)
+    return str(compiled), parameters
+
+
+def query_plan(connection, sql, parameters):
+    return [row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+
+
+def measure(connection, statements, scale, samples):
+    results = {}
+    for name, (sql, parameters) in statements.items():
+        plan = query_plan(connection, sql, parameters(1))
+        timings = []
+        for sample in range(samples):
+            values = parameters(random.randint(1, scale))
+            start = time.perf_counter()
+            connection.execute(sql, values).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {"plan": plan, "p50_ms": round(statistics.median(timings), 3), "max_ms": round(max(timings), 3)}
+        print("  %-22s p50 %9.3f ms  plan: %s" % (name, results[name]["p50_ms"], " / ".join(plan)), flush=True)
+    return results
+
+
+def run_bench(scale, favorites, requests, output):
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "bench.py"), "--scale", str(scale),
+        "--favorites", str(favorites), "-n", str(requests), "--only", SCENARIOS, "-o", output], check=True)
+    with open(output) as file:
+        return json.load(file)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1000000, help="users, characters and planets to seed")
+    parser.add_argument("--favorites", type=int, default=10, help="favorite characters and planets per user")
+    parser.add_argument("--samples", type=int, default=50, help="timed executions of every statement")
+    parser.add_argument("--requests", "-n", type=int, default=200, help="requests per bench.py scenario")
+    parser.add_argument("--output", "-o", help="where to save the results (default benchmarks/results/<date>-favorites-index.json)")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = "sqlite:///" + database_path(args.scale)
+    sys.path.insert(0, SRC)
+    if not is_seeded(args.scale, args.favorites):
+        start = time.perf_counter()
+        seed(args.scale, args.favorites)
+        print("seeded %d rows per table in %.1fs" % (args.scale, time.perf_counter() - start), flush=True)
+
+    statements = lookups()
+    connection = sqlite3.connect(database_path(args.scale))
+    definitions = {name: sql for name, sql in connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name IN (?, ?)", INDEXES)}
+    results = {}
+    try:
+        print("without the indexes", flush=True)
+        for name in definitions:
+            connection.execute("DROP INDEX %s" % name)
+        connection.commit()
+        results["without_indexes"] = {
+            "statements": measure(connection, statements, args.scale, args.samples),
+            "bench": run_bench(args.scale, args.favorites, args.requests, "/tmp/favorites-index-without.json"),
+        }
+    finally:
+        start = time.perf_counter()
+        for name, sql in definitions.items():
+            connection.execute("DROP INDEX IF EXISTS %s" % name)
+            connection.execute(sql)
+        connection.commit()
+        print("indexes built in %.1fs" % (time.perf_counter() - start), flush=True)
+    print("with the indexes", flush=True)
+    results["with_indexes"] = {
+        "statements": measure(connection, statements, args.scale, args.samples),
+        "bench": run_bench(args.scale, args.favorites, args.requests, "/tmp/favorites-index-with.json"),
+    }
+    connection.close()
+
+    print("%-24s %14s %14s" % ("bench scenario p50 ms", "without", "with"))
+    for name in results["with_indexes"]["bench"]:
+        print("%-24s %14s %14s" % (name, results["without_indexes"]["bench"][name]["p50_ms"],
+            results["with_indexes"]["bench"][name]["p50_ms"]))
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+            "scale": args.scale, "favorites": args.favorites},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, "%s-favorites-index.json" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("results saved in %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Latency of the /search typeahead query across dataset sizes: ranking every FTS5 match
+(ORDER BY rank over the whole match set) against ranking only the first SEARCH_CANDIDATES matches.
+
+    pipenv run python benchmarks/search_latency.py                                # 10k, 100k and 1M rows
+    pipenv run python benchmarks/search_latency.py --scales 10000,100000 -r 50
+
+The databases are the bench.py ones: reused with whatever favorites they were seeded with, seeded
+with --favorites if missing or older than the migrations.
+Every query runs on SQLite straight, with the statements search.py builds; p50/p99 per scale,
+query and variant are saved as JSON next to the bench.py results.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench import RESULTS, SRC, database_path, git_commit, is_seeded, percentile
+
+# what a user types, one letter at a time; the seeded names are "Luke 123" and "Tatooine 123"
+QUERIES = {
+    "characters": ("l", "lu", "luk", "luke", "luke 12345"),
+    "planets": ("t", "ta", "tat", "tatooine", "tatooine 12345"),
+}
+FULL_RANK = "SELECT rowid AS id, name FROM {table}_fts WHERE {table}_fts MATCH :match ORDER BY rank LIMIT :limit"
+
+
+def seeded(scale, favorites):
+    # only characters and planets are searched, the favorites of an existing database do not matter
+    try:
+        connection = sqlite3.connect(database_path(scale))
+        favorites = connection.execute("SELECT favorites FROM bench_meta").fetchone()[0]
+        connection.close()
+    except (sqlite3.Error, TypeError):
+        pass
+    if is_seeded(scale, favorites):
+        return
+    # seed() imports the app, which reads DATABASE_URL once, so every new database is seeded in its own process
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + database_path(scale))
+    code = "import sys; sys.path.insert(0, %r); from bench import seed; seed(%d, %d)" % (os.path.dirname(__file__), scale, favorites)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=SRC, env=env, check=True)
+    print("seeded %d rows per table in %.1fs" % (scale, time.perf_counter() - start), flush=True)
+
+
+def measure(connection, sql, params, runs):
+    rows = connection.execute(sql, params).fetchall()
+    timings = []
+    for run in range(runs):
+        start = time.perf_counter()
+        connection.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(statistics.median(timings), 3), "p99_ms": round(percentile(timings, 0.99), 3),
+        "rows": len(rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10000,100000,1000000", help="comma separated numbers of rows per table")
+    parser.add_argument("--favorites", type=int, default=5, help="favorites per user when a database is seeded")
+    parser.add_argument("--runs", "-r", type=int, default=20, help="timed executions of every query")
+    parser.add_argument("--limit", type=int, default=10, help="results per query, as ?limit=")
+    parser.add_argument("--output", "-o", help="where to save the results (default benchmarks/results/<date>-search.json)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC)
+    from search import SEARCH_CANDIDATES, SQLITE_SEARCH, fts_query
+    variants = {"full_rank": FULL_RANK, "bounded_rank": SQLITE_SEARCH}
+
+    results = {}
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        seeded(scale, args.favorites)
+        connection = sqlite3.connect(database_path(scale))
+        results[scale] = {}
+        for table, queries in QUERIES.items():
+            for q in queries:
+                params = {"match": fts_query(q), "candidates": max(args.limit, SEARCH_CANDIDATES), "limit": args.limit}
+                key = "%s:%s" % (table, q)
+                results[scale][key] = {name: measure(connection, sql.format(table=table), params, args.runs)
+                    for name, sql in variants.items()}
+                print("%8d %-26s %s" % (scale, key, "  ".join("%s p50 %8.3f ms" % (name, result["p50_ms"])
+                    for name, result in results[scale][key].items())), flush=True)
+        connection.close()
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "runs": args.runs,
+            "limit": args.limit, "candidates": SEARCH_CANDIDATES},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, "%s-search.json" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("results saved in %s" % output)
+
+
+if __name__ == "__main__":
+    main()
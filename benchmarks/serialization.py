@@ -0,0 +1,95 @@
+"""
+Rows/sec of the list serialization: ORM objects + serialize() + flask's stdlib JSON (FAST_SERIALIZATION=0)
+against column tuples + orjson (FAST_SERIALIZATION=1), and the two mixes to see what each half gives.
+
+    pipenv run python benchmarks/serialization.py                 # 100k characters and planets, 5 runs
+    pipenv run python benchmarks/serialization.py --scale 1000000 -r 3
+
+Every run loads the whole table and encodes it to one JSON response with provider.response(), as
+jsonify does for GET /people and /planets without the response cache. Loading and encoding are timed
+separately; medians are saved as JSON next to the bench.py results.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from bench import RESULTS, SRC, database_path, git_commit, is_seeded, seed
+
+# name -> (rows as column tuples, encoded with orjson)
+PATHS = {
+    "orm_stdlib": (False, False),
+    "orm_orjson": (False, True),
+    "tuples_stdlib": (True, False),
+    "tuples_orjson": (True, True),
+}
+
+
+def load(model, tuples):
+    from models import db
+    if tuples:
+        return [row._asdict() for row in db.session.query(*[getattr(model, name) for name in model.serialize_columns])]
+    return [row.serialize() for row in model.query]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=100000, help="characters and planets in the database")
+    parser.add_argument("--runs", "-r", type=int, default=5, help="runs per path and table")
+    parser.add_argument("--output", "-o", help="where to save the results (default benchmarks/results/<date>-serialization.json)")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = "sqlite:///" + database_path(args.scale)
+    sys.path.insert(0, SRC)
+    if not is_seeded(args.scale, 5):
+        seed(args.scale, 5)
+
+    from flask.json.provider import DefaultJSONProvider
+    from app import app
+    from json_provider import ORJSONProvider
+    from models import db, Characters, Planets
+    providers = {False: DefaultJSONProvider(app), True: ORJSONProvider(app)}
+
+    results = {}
+    with app.app_context():
+        for model in (Characters, Planets):
+            table = model.__tablename__
+            results[table] = {}
+            for name, (tuples, orjson) in PATHS.items():
+                load_timings, encode_timings = [], []
+                for run in range(args.runs):
+                    start = time.perf_counter()
+                    rows = load(model, tuples)
+                    loaded = time.perf_counter()
+                    body = providers[orjson].response(rows).get_data()
+                    load_timings.append(loaded - start)
+                    encode_timings.append(time.perf_counter() - loaded)
+                    db.session.remove()
+                load_seconds = statistics.median(load_timings)
+                encode_seconds = statistics.median(encode_timings)
+                results[table][name] = {
+                    "rows_per_second": round(args.scale / (load_seconds + encode_seconds)),
+                    "load_ms": round(load_seconds * 1000, 1),
+                    "encode_ms": round(encode_seconds * 1000, 1),
+                    "encode_rows_per_second": round(args.scale / encode_seconds),
+                    "bytes": len(body),
+                }
+                print("%-10s %-14s %s" % (table, name, results[table][name]), flush=True)
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "scale": args.scale,
+            "runs": args.runs},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, "%s-serialization.json" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("results saved in %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure the cold start of the app for every BOOT_PROFILE (full, slim, api).
+
+    pipenv run bench-startup            # 5 runs per profile
+    pipenv run bench-startup -r 10 --profiles full,api
+
+import_ms is the cumulative import time of the app module from `python -X importtime`, with its
+heaviest imports; first_request_ms is the time from starting a one-worker gunicorn until it
+answers GET /people/1. Medians of --runs runs, saved as JSON next to the bench.py results.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench import RESULTS, SRC, database_path, free_port, git_commit, http_request, is_seeded, seed
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(env):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=SRC, env=env,
+        capture_output=True, text=True, check=True).stderr
+    total = None
+    children = {}
+    for match in IMPORTTIME_LINE.finditer(output):
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if name == "app" and indent == 1:
+            total = cumulative
+        elif indent == 3:
+            # direct imports of app.py
+            children[name] = cumulative
+    return total / 1000, {name: value / 1000 for name, value in children.items()}
+
+
+def first_request(env):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "wsgi", "--chdir", SRC, "-b", "127.0.0.1:%d" % port,
+        "-w", "1", "--log-level", "warning"], env=env)
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                status, size = http_request(port, "GET", "/people/1", None)
+                if status == 200:
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError("gunicorn did not answer")
+            time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", "-r", type=int, default=5, help="runs per profile")
+    parser.add_argument("--profiles", default="full,slim,api", help="BOOT_PROFILE values to measure")
+    parser.add_argument("--output", "-o", help="where to save the results (default benchmarks/results/<date>-startup.json)")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = "sqlite:///" + database_path(1000)
+    sys.path.insert(0, SRC)
+    if not is_seeded(1000, 5):
+        seed(1000, 5)
+
+    results = {}
+    for profile in args.profiles.split(","):
+        env = dict(os.environ, BOOT_PROFILE=profile)
+        imports = [import_times(env) for run in range(args.runs)]
+        heaviest = sorted(imports[0][1].items(), key=lambda item: -item[1])[:5]
+        results[profile] = {
+            "import_ms": round(statistics.median(total for total, children in imports), 1),
+            "heaviest_imports_ms": {name: round(value, 1) for name, value in heaviest},
+            "first_request_ms": round(statistics.median(first_request(env) for run in range(args.runs)), 1),
+        }
+        print("%-6s %s" % (profile, results[profile]), flush=True)
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "runs": args.runs},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, "%s-startup.json" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("results saved in %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""favorite counters for the top characters and planets
+
+Revision ID: 3c8e1f4b7a25
+Revises: 9a4f6b1e3c70
+Create Date: 2026-10-18 13:05:47.221930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e1f4b7a25'
+down_revision = '9a4f6b1e3c70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('popular__characters',
+    sa.Column('character_id', sa.Integer(), nullable=False),
+    sa.Column('favorites', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['character_id'], ['characters.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('character_id')
+    )
+    op.create_index('ix_popular__characters_favorites', 'popular__characters', ['favorites', 'character_id'], unique=False)
+    op.create_table('popular__planets',
+    sa.Column('planet_id', sa.Integer(), nullable=False),
+    sa.Column('favorites', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['planet_id'], ['planets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('planet_id')
+    )
+    op.create_index('ix_popular__planets_favorites', 'popular__planets', ['favorites', 'planet_id'], unique=False)
+    # start from the favorites there already are
+    op.execute(
+        "INSERT INTO popular__characters (character_id, favorites) "
+        "SELECT character_id, COUNT(*) FROM fav__characters WHERE character_id IS NOT NULL GROUP BY character_id"
+    )
+    op.execute(
+        "INSERT INTO popular__planets (planet_id, favorites) "
+        "SELECT planet_id, COUNT(*) FROM fav__planets WHERE planet_id IS NOT NULL GROUP BY planet_id"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_popular__planets_favorites', table_name='popular__planets')
+    op.drop_table('popular__planets')
+    op.drop_index('ix_popular__characters_favorites', table_name='popular__characters')
+    op.drop_table('popular__characters')
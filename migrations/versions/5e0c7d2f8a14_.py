@@ -0,0 +1,28 @@
+"""indexes for people/planets filters and sorting
+
+Revision ID: 5e0c7d2f8a14
+Revises: b3d91f5c2a7e
+Create Date: 2026-10-18 11:03:47.120385
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0c7d2f8a14'
+down_revision = 'b3d91f5c2a7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_characters_gender', 'characters', ['gender'], unique=False)
+    op.create_index('ix_characters_eye_color', 'characters', ['eye_color'], unique=False)
+    op.create_index('ix_planets_diameter', 'planets', ['diameter'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_planets_diameter', table_name='planets')
+    op.drop_index('ix_characters_eye_color', table_name='characters')
+    op.drop_index('ix_characters_gender', table_name='characters')
@@ -0,0 +1,64 @@
+"""full-text name search for characters and planets
+
+Revision ID: 9a4f6b1e3c70
+Revises: 5e0c7d2f8a14
+Create Date: 2026-10-18 11:41:09.773512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f6b1e3c70'
+down_revision = '5e0c7d2f8a14'
+branch_labels = None
+depends_on = None
+
+
+def sqlite_upgrade(table):
+    # external content FTS5 table over <table>.name, with prefix indexes for the typeahead
+    op.execute(
+        "CREATE VIRTUAL TABLE %s_fts USING fts5(name, content='%s', content_rowid='id', prefix='1 2 3')" % (table, table)
+    )
+    op.execute("INSERT INTO %s_fts(%s_fts) VALUES ('rebuild')" % (table, table))
+    op.execute(
+        "CREATE TRIGGER %s_fts_insert AFTER INSERT ON %s BEGIN "
+        "INSERT INTO %s_fts(rowid, name) VALUES (new.id, new.name); END" % (table, table, table)
+    )
+    op.execute(
+        "CREATE TRIGGER %s_fts_delete AFTER DELETE ON %s BEGIN "
+        "INSERT INTO %s_fts(%s_fts, rowid, name) VALUES ('delete', old.id, old.name); END" % (table, table, table, table)
+    )
+    op.execute(
+        "CREATE TRIGGER %s_fts_update AFTER UPDATE OF name ON %s BEGIN "
+        "INSERT INTO %s_fts(%s_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO %s_fts(rowid, name) VALUES (new.id, new.name); END" % (table, table, table, table, table)
+    )
+
+
+def sqlite_downgrade(table):
+    for trigger in ("insert", "delete", "update"):
+        op.execute("DROP TRIGGER IF EXISTS %s_fts_%s" % (table, trigger))
+    op.execute("DROP TABLE IF EXISTS %s_fts" % table)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        sqlite_upgrade('characters')
+        sqlite_upgrade('planets')
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_characters_name_trgm ON characters USING gin (name gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_planets_name_trgm ON planets USING gin (name gin_trgm_ops)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        sqlite_downgrade('planets')
+        sqlite_downgrade('characters')
+    elif dialect == 'postgresql':
+        op.drop_index('ix_planets_name_trgm', table_name='planets')
+        op.drop_index('ix_characters_name_trgm', table_name='characters')
@@ -0,0 +1,35 @@
+"""unique indexes on favorites
+
+Revision ID: b3d91f5c2a7e
+Revises: 709ad166612a
+Create Date: 2026-10-18 10:12:31.508214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d91f5c2a7e'
+down_revision = '709ad166612a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # drop duplicated favorites (keeping the oldest one) so the unique indexes can be built
+    op.execute(
+        "DELETE FROM fav__characters WHERE id NOT IN "
+        "(SELECT id FROM (SELECT MIN(id) AS id FROM fav__characters GROUP BY user_id, character_id) AS keep)"
+    )
+    op.execute(
+        "DELETE FROM fav__planets WHERE id NOT IN "
+        "(SELECT id FROM (SELECT MIN(id) AS id FROM fav__planets GROUP BY user_id, planet_id) AS keep)"
+    )
+    op.create_index('ix_fav__characters_user_id_character_id', 'fav__characters', ['user_id', 'character_id'], unique=True)
+    op.create_index('ix_fav__planets_user_id_planet_id', 'fav__planets', ['user_id', 'planet_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_fav__planets_user_id_planet_id', table_name='fav__planets')
+    op.drop_index('ix_fav__characters_user_id_character_id', table_name='fav__characters')
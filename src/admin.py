@@ -1,20 +1,74 @@
 import os
+from collections import Counter
+from flask import g
 from flask_admin import Admin
 from models import db, User, Characters, Planets, Fav_Characters, Fav_Planets
 from flask_admin.contrib.sqla import ModelView
+from cache import invalidate
+from dashboard import invalidate_dashboards
+from popularity import count_favorites
 
-def setup_admin(app):
+class CachedModelView(ModelView):
+    # changes made from the admin also have to refresh the cached API responses
+    def after_model_change(self, form, model, is_created):
+        invalidate(self.model.__tablename__)
+
+    def after_model_delete(self, model):
+        invalidate(self.model.__tablename__)
+
+class FavoritesModelView(ModelView):
+    # favorites written from the admin keep the /people/top and /planets/top counters in the same
+    # transaction (on_model_*, before the commit) and refresh the dashboards of their users after it
+    def __init__(self, model, session, kind, column, **kwargs):
+        super().__init__(model, session, **kwargs)
+        self.kind = kind
+        self.column = column
+
+    def favorite(self, model):
+        return model.user_id, getattr(model, self.column)
+
+    def on_model_change(self, form, model, is_created):
+        # the form sets the user/character relationships, the ids are only synced by the flush
+        old = None if is_created else self.favorite(model)
+        self.session.flush()
+        new = self.favorite(model)
+        g.admin_favorites = [new] if old is None else [old, new]
+        if old != new:
+            deltas = Counter({new[1]: 1})
+            if old is not None:
+                deltas[old[1]] -= 1
+            self.count(deltas)
+
+    def on_model_delete(self, model):
+        g.admin_favorites = [self.favorite(model)]
+        self.count({self.favorite(model)[1]: -1})
+
+    def count(self, deltas):
+        # the admin allows favorites without a character/planet, those are not counted
+        count_favorites(self.kind, {target_id: delta for target_id, delta in deltas.items() if target_id is not None})
+
+    def refresh_dashboards(self):
+        favorites = g.pop("admin_favorites", ())
+        invalidate_dashboards(user_id for user_id, target_id in favorites if user_id is not None)
+
+    def after_model_change(self, form, model, is_created):
+        self.refresh_dashboards()
+
+    def after_model_delete(self, model):
+        self.refresh_dashboards()
+
+def setup_admin(app, url='/admin'):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3', url=url)
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Characters, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(Fav_Characters, db.session))
-    admin.add_view(ModelView(Fav_Planets, db.session))
+    admin.add_view(CachedModelView(User, db.session))
+    admin.add_view(CachedModelView(Characters, db.session))
+    admin.add_view(CachedModelView(Planets, db.session))
+    admin.add_view(FavoritesModelView(Fav_Characters, db.session, "characters", "character_id"))
+    admin.add_view(FavoritesModelView(Fav_Planets, db.session, "planets", "planet_id"))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
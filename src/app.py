@@ -3,15 +3,33 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 """
 import os
 from flask import Flask, request, jsonify, url_for, json
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from utils import FAST_SERIALIZATION, APIException, generate_sitemap, get_bool_arg, is_paginated_request, paginate_by_id, wants_stream, stream_ndjson, sorted_query, serialize_row
+from boot import needs_migrate, setup_admin_for_profile
+from json_provider import ORJSONProvider
+from bulk import bulk_create, bulk_update, bulk_delete
+from cache import cached_response, invalidate, response_cache
+from compression import setup_compression
+from ratelimit import setup_rate_limits
+from search import search, include_object
+from pool import engine_options, apply_sqlite_profile, pool_stats
+from metrics import setup_metrics
+from group_commit import favorites_group_commit
+from replicas import replica_binds, setup_replicas
+from popularity import count_favorites, top, reconcile_popularity_command
+from catalog import catalog_cli
+from dashboard import dashboard, dashboard_table, invalidate_dashboards
+from snapshot import reference_snapshot
+from shared_snapshot import shared_snapshots
 from models import db, User, Characters, Planets, Fav_Characters, Fav_Planets
 #from models import Person
 
 app = Flask(__name__)
+# con FAST_SERIALIZATION=0 se queda el JSON de flask (stdlib), con los no-ASCII escapados como \u00f1
+if FAST_SERIALIZATION:
+    app.json = ORJSONProvider(app)
 app.url_map.strict_slashes = False
 
 db_url = os.getenv("DATABASE_URL")
@@ -20,11 +38,34 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+# tamaño del pool, overflow, recycle y pre-ping se configuran con variables de entorno (ver pool.py)
+# con sqlite se usa ademas un perfil de rendimiento: WAL, mmap, synchronous=NORMAL... (SQLITE_TUNING=0 lo desactiva)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# replicas de lectura opcionales (DATABASE_REPLICA_URLS), los GET leen de ellas (ver replicas.py)
+app.config['SQLALCHEMY_BINDS'] = replica_binds(engine_options)
+
+# con BOOT_PROFILE=slim o api los workers arrancan sin cargar flask-admin ni alembic (ver boot.py)
+if needs_migrate():
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db, include_object=include_object)
 db.init_app(app)
 CORS(app)
-setup_admin(app)
+# limites por cliente y endpoint (RATE_LIMITS, CONCURRENCY_LIMITS), lo primero para que lo rechazado no toque nada (ver ratelimit.py)
+setup_rate_limits(app)
+setup_admin_for_profile(app)
+favorites_group_commit.init_app(app)
+setup_replicas(app)
+app.cli.add_command(reconcile_popularity_command)
+app.cli.add_command(catalog_cli)
+with app.app_context():
+    for engine in db.engines.values():
+        apply_sqlite_profile(engine)
+    pool_stats.attach(db.engine)
+setup_metrics(app)
+# gzip/br/zstd segun Accept-Encoding, lo comprimido de las respuestas con ETag se guarda en la cache (ver compression.py)
+setup_compression(app, response_cache)
+reference_snapshot.init_app(app)
+shared_snapshots.init_app(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,16 +77,24 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+# estado del pool de conexiones de este worker, para dimensionar DB_POOL_SIZE / DB_MAX_OVERFLOW
+@app.route('/metrics/pool', methods=['GET'])
+def get_pool_metrics():
+    return jsonify(pool_stats.to_dict()), 200
+
 
 #***************** USERS *************************
 
 #ENDPOINT GET LOS USUARIOS CREADOS
 @app.route('/user', methods=['GET'])
 def get_users():
-    users = User.query.all()
+    # con ?limit=N&after=<id> devolvemos una pagina y el cursor 'next' para pedir la siguiente
+    if is_paginated_request():
+        return jsonify(paginate_by_id(User)), 200
+    users = sorted_query(User).all()
     user_list = []
     for user in users:
-        user_list.append(user.serialize())
+        user_list.append(serialize_row(user))
     return jsonify(user_list), 200
 
 #ENDPOINT GET UN USUARIO SEGÚN SU ID
@@ -55,21 +104,43 @@ def get_user(id):
     user = user.serialize()
     return jsonify(user), 200
 
+#ENDPOINT GET EL USUARIO CON SUS FAVORITOS (characters y planets completos) EN UNA SOLA LLAMADA, 2 queries en vez de las 3 llamadas
+@app.route('/user/<int:id>/dashboard', methods=['GET'])
+@cached_response(dashboard_table, User.__tablename__, Characters.__tablename__, Planets.__tablename__)
+def get_user_dashboard(id):
+    return jsonify(dashboard(id)), 200
+
+
 
 #***************** CHARACTERS *************************
 
 #ENDPOINT GET CHARACTERS CREADOS
 @app.route('/people', methods=['GET'])
+@cached_response(Characters.__tablename__)
 def get_characters():
-    characters = Characters.query.all()
+    # export completo en NDJSON, fila a fila, sin montar la lista entera en memoria
+    if wants_stream():
+        return stream_ndjson(Characters)
+    # con REFERENCE_SNAPSHOT=1 se contesta desde la copia en memoria, sin ir a la base de datos (ver snapshot.py)
+    body = reference_snapshot.list_body(Characters)
+    if body is not None:
+        return jsonify(body), 200
+    if is_paginated_request():
+        return jsonify(paginate_by_id(Characters)), 200
+    # ?fields=, ?filter[campo]= y ?sort= se convierten en el SELECT, WHERE y ORDER BY de la query (ver utils.py)
+    characters = sorted_query(Characters).all()
     characters_list = []
     for character in characters:
-        characters_list.append(character.serialize())
+        characters_list.append(serialize_row(character))
     return jsonify(characters_list), 200
 
 #ENDPOINT GET UN CHARACTER SEGÚN SU ID
 @app.route('/people/<int:id>', methods=['GET'])
+@cached_response(Characters.__tablename__)
 def get_character(id):
+    character = reference_snapshot.get_body(Characters, id)
+    if character is not None:
+        return jsonify(character), 200
     character = Characters.query.filter_by(id=id).one()
     character = character.serialize()
     return jsonify(character), 200
@@ -90,6 +161,7 @@ def create_character():
         eye_color = data["eye_color"])
     db.session.add(character_new)
     db.session.commit()
+    invalidate(Characters.__tablename__)
     response_body = {
         "msg": "Añadido un personaje"
     }
@@ -104,6 +176,7 @@ def modify_character(id):
     character_modified.skin_color = data["skin_color"]
     character_modified.verified = True
     db.session.commit()
+    invalidate(Characters.__tablename__)
     response_body = {
         "msg": "Personaje modificado"
     }
@@ -116,28 +189,56 @@ def delete_character(id):
     character_deleted = Characters.query.filter_by(id=id).one()
     db.session.delete(character_deleted)
     db.session.commit()
+    invalidate(Characters.__tablename__)
     response_body = {
         "msg": "Personaje borrado"
     }
     return jsonify(response_body), 200
 
 
+#ENDPOINTS BULK: RECIBEN UN ARRAY Y HACEN UN COMMIT POR CADA BLOQUE EN VEZ DE UNO POR CHARACTER
+# la respuesta trae el resultado de cada elemento en el mismo orden que el array del body
+@app.route('/people/bulk', methods=['POST'])
+def create_characters_bulk():
+    return jsonify(bulk_create(Characters, request.get_json())), 200
+
+@app.route('/people/bulk', methods=['PUT'])
+def modify_characters_bulk():
+    return jsonify(bulk_update(Characters, request.get_json())), 200
+
+@app.route('/people/bulk', methods=['DELETE'])
+def delete_characters_bulk():
+    return jsonify(bulk_delete(Characters, request.get_json())), 200
+
+
 
 #***************** PLANETS *************************
 
 
 #ENDPOINT GET PLANETS CREADOS
 @app.route('/planets', methods=['GET'])
+@cached_response(Planets.__tablename__)
 def get_planets():
-    planets = Planets.query.all()
+    if wants_stream():
+        return stream_ndjson(Planets)
+    body = reference_snapshot.list_body(Planets)
+    if body is not None:
+        return jsonify(body), 200
+    if is_paginated_request():
+        return jsonify(paginate_by_id(Planets)), 200
+    planets = sorted_query(Planets).all()
     planets_list = []
     for planet in planets:
-        planets_list.append(planet.serialize())
+        planets_list.append(serialize_row(planet))
     return jsonify(planets_list), 200
 
 #ENDPOINT GET UN PLANET SEGÚN SU ID
 @app.route('/planets/<int:id>', methods=['GET'])
+@cached_response(Planets.__tablename__)
 def get_planet(id):
+    planet = reference_snapshot.get_body(Planets, id)
+    if planet is not None:
+        return jsonify(planet), 200
     planet = Planets.query.filter_by(id=id).one()
     planet = planet.serialize()
     return jsonify(planet), 200
@@ -155,6 +256,7 @@ def create_planet():
         orbital_period = data["orbital_period"])
     db.session.add(planet_new)
     db.session.commit()
+    invalidate(Planets.__tablename__)
     response_body = {
         "msg": "Añadido un planet"
     }
@@ -169,6 +271,7 @@ def modify_planets(id):
     planet_modified.diameter = data["diameter"]
     planet_modified.verified = True
     db.session.commit()
+    invalidate(Planets.__tablename__)
     response_body = {
         "msg": "Planet modificado"
     }
@@ -180,13 +283,56 @@ def delete_planet(id):
     planet_deleted = Planets.query.filter_by(id=id).one()
     db.session.delete(planet_deleted)
     db.session.commit()
+    invalidate(Planets.__tablename__)
     response_body = {
         "msg": "Planet borrado"
     }
     return jsonify(response_body), 200
 
+#ENDPOINTS BULK DE PLANETS
+@app.route('/planets/bulk', methods=['POST'])
+def create_planets_bulk():
+    return jsonify(bulk_create(Planets, request.get_json())), 200
+
+@app.route('/planets/bulk', methods=['PUT'])
+def modify_planets_bulk():
+    return jsonify(bulk_update(Planets, request.get_json())), 200
+
+@app.route('/planets/bulk', methods=['DELETE'])
+def delete_planets_bulk():
+    return jsonify(bulk_delete(Planets, request.get_json())), 200
+
+
+#***************** LOS MAS FAVORITOS *************************
+
+#ENDPOINT DE LOS MAS FAVORITOS: /people/top?limit=10 y /planets/top?limit=10
+@app.route('/people/top', methods=['GET'])
+def get_top_people():
+    return jsonify(top("characters")), 200
+
+@app.route('/planets/top', methods=['GET'])
+def get_top_planets():
+    return jsonify(top("planets")), 200
+
+
+#***************** BUSCADOR *************************
+
+#ENDPOINT PARA EL TYPEAHEAD: /search?q=luk&type=people&limit=10 (type es opcional, sin type busca en people y planets)
+@app.route('/search', methods=['GET'])
+def search_by_name():
+    return jsonify(search(request.args.get("q"), request.args.get("type"))), 200
+
 
 #***************** FAVORITOS USUARIO *************************
+
+def favorite_response(ok):
+    if ok:
+        return jsonify({"msg": "ok"}), 200
+    # None: el group commit no pudo guardar el lote (error de la base de datos o timeout), se puede reintentar
+    if ok is None:
+        return jsonify({"msg": "ko"}), 503
+    return jsonify({"msg": "ko"}), 400
+
 #********** CHARACTERS *************
 
 # la parte de la ruta /user/yelid es ficticia pa que parezca que pertenecen a un user segun su id, peor en la siguiente clase vemos la autenticacion
@@ -194,18 +340,30 @@ def delete_planet(id):
 # como parametro de la funcion uso la variable de la ruta
 def add_fav_character(id):
     id_character = request.json.get("id_character", None)
+    # con FAVORITES_GROUP_COMMIT_MS los favoritos de varias peticiones se guardan juntos en una sola transaccion (ver group_commit.py)
+    if favorites_group_commit.enabled:
+        return favorite_response(favorites_group_commit.submit("characters", "add", id, id_character))
     # el primer id en el siguiente parentesis es el nombre de la columna id del class Character
     fav_character = Characters.query.filter_by(id=id_character).first()
     # en la siguiente linea buscamos un  usuario con ese id ¿ese id cual, el de la ruta? sii
     # el primer id es la key del modelo user, el segundo es el argumento de la funcion
     user = User.query.filter_by(id=id).first()
-    print(fav_character)
     if fav_character and user:
-        # vamos a crear el objeto, es asi como se crea un objeto en base a un modelo con sql alchemy, las key son las key del modelo character
-        favorite = Fav_Characters(user_id=user.id, character_id=fav_character.id)
-        # y lo añadimos a la db
-        db.session.add(favorite)
-        db.session.commit()
+        # si ya lo tiene de favorito no lo duplicamos (hay un indice unico por user_id + character_id)
+        favorite = Fav_Characters.query.filter_by(user_id=user.id, character_id=fav_character.id).first()
+        if favorite is None:
+            # vamos a crear el objeto, es asi como se crea un objeto en base a un modelo con sql alchemy, las key son las key del modelo character
+            favorite = Fav_Characters(user_id=user.id, character_id=fav_character.id)
+            # y lo añadimos a la db
+            db.session.add(favorite)
+            # el contador de /people/top va en la misma transaccion (ver popularity.py)
+            count_favorites("characters", {fav_character.id: 1})
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # otra peticion lo ha creado a la vez, el resultado es el mismo
+                db.session.rollback()
+            invalidate_dashboards([user.id])
 
         response_body = {
             "msg": "ok"
@@ -223,15 +381,19 @@ def add_fav_character(id):
 @app.route('/user/<int:id>/fav_characters', methods=['DELETE'])
 def delete_fav_character(id):
     id_character = request.json.get("id_character", None)
+    if favorites_group_commit.enabled:
+        return favorite_response(favorites_group_commit.submit("characters", "delete", id, id_character))
     delete_fav_character = Characters.query.filter_by(id=id_character).first()
     user = User.query.filter_by(id=id).first()
-    print(delete_fav_character)
-    print(user)
     if delete_fav_character and user:
         # añado que lo busco, no lo creo como en el POST
         favorite = Fav_Characters.query.filter_by(user_id=user.id, character_id=delete_fav_character.id).first()
+        if favorite is None:
+            return favorite_response(False)
         db.session.delete(favorite)
+        count_favorites("characters", {delete_fav_character.id: -1})
         db.session.commit()
+        invalidate_dashboards([user.id])
 
         response_body = {
             "msg": "ok"
@@ -248,6 +410,10 @@ def delete_fav_character(id):
 def get_fav_character(id):
     user = User.query.filter_by(id=id).first()
     # y si quiero en la siguiente linea decir que todos lo que sean asi en vez de first()? pues all parece 
+    # con ?expand=1 traemos tambien el character completo en la misma query (join), asi el front no tiene que pedir /people/<id> por cada favorito
+    if get_bool_arg("expand"):
+        favoritos = Fav_Characters.query.options(joinedload(Fav_Characters.character)).filter_by(user_id=user.id).all()
+        return jsonify([favorito.serialize_expanded() for favorito in favoritos]), 200
     favoritos = Fav_Characters.query.filter_by(user_id=user.id).all()
     fav_characters_list = []
     for favorito in favoritos:
@@ -259,17 +425,25 @@ def get_fav_character(id):
 @app.route('/user/<int:id>/fav_planets', methods=['POST'])
 def add_fav_planet(id):
     id_planet = request.json.get("id_planet", None)
+    if favorites_group_commit.enabled:
+        return favorite_response(favorites_group_commit.submit("planets", "add", id, id_planet))
     # el primer id en el siguiente parentesis es el nombre de la columna id del class Planet
     fav_planet = Planets.query.filter_by(id=id_planet).first()
     # en la siguiente linea buscamos un usuario con ese id
     user = User.query.filter_by(id=id).first()
-    print(fav_planet)
     if fav_planet and user:
-        # ya encontramos tal y tal, ahora vamos a crear el objeto usando lo encontrado, es asi como se crea un objeto en base a un modelo con sql alchemy
-        favorite = Fav_Planets(user_id=user.id, planet_id=fav_planet.id)
-        # y lo añadimos a la db
-        db.session.add(favorite)
-        db.session.commit()
+        favorite = Fav_Planets.query.filter_by(user_id=user.id, planet_id=fav_planet.id).first()
+        if favorite is None:
+            # ya encontramos tal y tal, ahora vamos a crear el objeto usando lo encontrado, es asi como se crea un objeto en base a un modelo con sql alchemy
+            favorite = Fav_Planets(user_id=user.id, planet_id=fav_planet.id)
+            # y lo añadimos a la db
+            db.session.add(favorite)
+            count_favorites("planets", {fav_planet.id: 1})
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            invalidate_dashboards([user.id])
 
         response_body = {
             "msg": "ok"
@@ -287,15 +461,19 @@ def add_fav_planet(id):
 @app.route('/user/<int:id>/fav_planets', methods=['DELETE'])
 def delete_fav_planet(id):
     id_planet = request.json.get("id_planet", None)
+    if favorites_group_commit.enabled:
+        return favorite_response(favorites_group_commit.submit("planets", "delete", id, id_planet))
     delete_fav_planet = Planets.query.filter_by(id=id_planet).first()
     user = User.query.filter_by(id=id).first()
-    print(delete_fav_planet)
-    print(user)
     if delete_fav_planet and user:
         # añado que lo busco, no lo creo como en el POST
         favorite = Fav_Planets.query.filter_by(user_id=user.id, planet_id=delete_fav_planet.id).first()
+        if favorite is None:
+            return favorite_response(False)
         db.session.delete(favorite)
+        count_favorites("planets", {delete_fav_planet.id: -1})
         db.session.commit()
+        invalidate_dashboards([user.id])
 
         response_body = {
             "msg": "ok"
@@ -312,6 +490,9 @@ def delete_fav_planet(id):
 def get_fav_planet(id):
     user = User.query.filter_by(id=id).first()
     # y si quiero en la siguiente linea decir que todos lo que sean asi en vez de first()?
+    if get_bool_arg("expand"):
+        favoritos = Fav_Planets.query.options(joinedload(Fav_Planets.planet)).filter_by(user_id=user.id).all()
+        return jsonify([favorito.serialize_expanded() for favorito in favoritos]), 200
     favoritos = Fav_Planets.query.filter_by(user_id=user.id).all()
     fav_planets_list = []
     for favorito in favoritos:
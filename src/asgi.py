@@ -0,0 +1,148 @@
+# This file runs the same API under an ASGI server (uvicorn, or gunicorn with uvicorn workers):
+#   uvicorn asgi:application --app-dir src
+#   gunicorn asgi:application -k uvicorn.workers.UvicornWorker --chdir ./src/
+# The GET routes of users, people and planets read the database with an async engine (aiosqlite/asyncpg),
+# so a worker keeps serving other requests while it waits for the database. Everything else
+# (writes, favorites, search, NDJSON exports, admin) goes to the regular flask app in a thread.
+
+import os
+import re
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify, request
+from sqlalchemy import select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import app, handle_invalid_usage
+from pool import apply_sqlite_profile, engine_options
+from ratelimit import rate_limiter
+from snapshot import reference_snapshot
+from shared_snapshot import shared_snapshots
+from models import User, Characters, Planets
+from utils import (APIException, apply_filters, get_fields, get_order_by, get_page_params, is_paginated_request,
+    page_body, serialize_row, wants_stream)
+
+def async_database_url(url):
+    for sync_prefix, async_prefix in (("sqlite://", "sqlite+aiosqlite://"), ("postgresql://", "postgresql+asyncpg://")):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+def async_engine_options(url):
+    # the same pool sizes as the sync engine (DB_POOL_*); aiosqlite defaults to NullPool, a new
+    # connection and its thread for every request, which at 1k concurrent requests is 1k threads
+    options = {key: value for key, value in engine_options(url).items()
+        if key in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")}
+    if options:
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return options
+
+engine = create_async_engine(
+    os.getenv("ASYNC_DATABASE_URL") or async_database_url(app.config['SQLALCHEMY_DATABASE_URI']),
+    **async_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+)
+# same WAL/mmap/cache pragmas as the sync engine (pool.py)
+apply_sqlite_profile(engine.sync_engine)
+wsgi_application = WsgiToAsgi(app)
+
+# path -> model, and if the path has the id of one row
+ASYNC_ROUTES = [
+    (re.compile(r"/user/?"), User),
+    (re.compile(r"/user/(\d+)/?"), User),
+    (re.compile(r"/people/?"), Characters),
+    (re.compile(r"/people/(\d+)/?"), Characters),
+    (re.compile(r"/planets/?"), Planets),
+    (re.compile(r"/planets/(\d+)/?"), Planets),
+]
+
+def match_route(path):
+    for pattern, model in ASYNC_ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            return model, int(match.group(1)) if match.groups() else None
+    return None, None
+
+async def fetch_all(statement):
+    async with engine.connect() as connection:
+        result = await connection.execute(statement)
+        return result.all()
+
+async def get_list(model):
+    # same params and checks as the flask views (fields, filter, sort, limit/after), see utils.py
+    statement = apply_filters(model, select(*[getattr(model, column) for column in get_fields(model)]))
+    if is_paginated_request():
+        limit, after, order_by = get_page_params(model)
+        if after is not None:
+            statement = statement.where(model.id > after)
+        rows = await fetch_all(statement.order_by(*order_by).limit(limit + 1))
+        return page_body(rows, limit)
+    order_by, _ = get_order_by(model)
+    rows = await fetch_all(statement.order_by(*order_by))
+    return [serialize_row(row) for row in rows]
+
+async def get_one(model, id):
+    columns = [getattr(model, column) for column in model.serialize_columns]
+    rows = await fetch_all(select(*columns).where(model.id == id))
+    if not rows:
+        raise APIException("Not found", status_code=404)
+    return serialize_row(rows[0])
+
+async def read_endpoint(scope, model, id):
+    headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]]
+    # the client address is the rate limit key when there is no RATE_LIMIT_KEY_HEADER
+    client = scope.get("client") or ("", 0)
+    with app.test_request_context(scope["path"], method=scope["method"], query_string=scope["query_string"], headers=headers,
+            environ_base={"REMOTE_ADDR": client[0]}):
+        if wants_stream():
+            # NDJSON exports stay on the flask view
+            return None
+        # same RATE_LIMITS/CONCURRENCY_LIMITS as the flask views
+        response = rate_limiter.admit()
+        if response is not None:
+            return app.process_response(response)
+        try:
+            if id is None:
+                body = await get_list(model)
+            else:
+                body = await get_one(model, id)
+            response = jsonify(body)
+            response.add_etag()
+            response.make_conditional(request)
+        except APIException as error:
+            response = app.make_response(handle_invalid_usage(error))
+        finally:
+            rate_limiter.release()
+        # after_request handlers, e.g. the CORS headers
+        return app.process_response(response)
+
+async def send_response(send, response, request_method):
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()],
+    })
+    body = b"" if request_method == "HEAD" else response.get_data()
+    await send({"type": "http.response.body", "body": body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+        model, id = match_route(scope["path"])
+        # with REFERENCE_SNAPSHOT or SHARED_SNAPSHOT_DIR the flask app answers characters and planets from memory,
+        # faster than the database
+        if model is not None and not any(snapshot.enabled and model in snapshot.models
+                for snapshot in (reference_snapshot, shared_snapshots)):
+            response = await read_endpoint(scope, model, id)
+            if response is not None:
+                return await send_response(send, response, scope["method"])
+    await wsgi_application(scope, receive, send)
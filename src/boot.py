@@ -0,0 +1,60 @@
+import os
+import threading
+import click
+from flask import Flask
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+# what gets loaded when the app is imported, for faster gunicorn worker boots
+#   BOOT_PROFILE=full   everything on import, as always (default)
+#   BOOT_PROFILE=slim   /admin is built on its first request; Flask-Migrate (alembic) only under the flask CLI
+#   BOOT_PROFILE=api    same as slim but without /admin at all, for API-only workers
+BOOT_PROFILES = ("full", "slim", "api")
+BOOT_PROFILE = os.getenv("BOOT_PROFILE", "full")
+if BOOT_PROFILE not in BOOT_PROFILES:
+    raise ValueError("BOOT_PROFILE must be one of: " + ", ".join(BOOT_PROFILES))
+
+def needs_migrate():
+    # `flask db ...` always needs it, a gunicorn worker never does
+    return BOOT_PROFILE == "full" or os.getenv("FLASK_RUN_FROM_CLI") == "true"
+
+def running_command():
+    # True inside a flask command that is not a server (catalog import, reconcile-popularity, db, shell...);
+    # gunicorn and the requests of `flask run` have no click context, or the one of `run`
+    context = click.get_current_context(silent=True)
+    return context is not None and context.command.name != "run"
+
+class LazyWSGIApp:
+    # builds the wrapped app on its first request
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.app = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self.app is None:
+            with self.lock:
+                if self.app is None:
+                    self.app = self.factory()
+        return self.app(environ, start_response)
+
+def create_admin_app(app):
+    # a small flask app with only the admin, same config and database as the API
+    from admin import setup_admin
+    from models import db
+    from pool import apply_sqlite_profile
+    admin_app = Flask(app.import_name, static_folder=None)
+    admin_app.config.update(app.config)
+    db.init_app(admin_app)
+    with admin_app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_profile(engine)
+    setup_admin(admin_app, url="/")
+    return admin_app
+
+def setup_admin_for_profile(app):
+    if BOOT_PROFILE == "full":
+        from admin import setup_admin
+        setup_admin(app)
+    elif BOOT_PROFILE == "slim":
+        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {"/admin": LazyWSGIApp(lambda: create_admin_app(app))})
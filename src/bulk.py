@@ -0,0 +1,108 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from cache import invalidate
+from models import db
+from utils import APIException
+
+# every chunk is one executemany + one commit
+BULK_CHUNK_SIZE = 500
+BULK_MAX_ITEMS = 10000
+
+def get_bulk_items(data):
+    if not isinstance(data, list):
+        raise APIException("The body must be a JSON array", status_code=400)
+    if len(data) > BULK_MAX_ITEMS:
+        raise APIException("Too many items, the maximum is %d" % BULK_MAX_ITEMS, status_code=400)
+    return data
+
+def model_fields(model):
+    return [column.name for column in model.__table__.columns if column.name != "id"]
+
+def chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def summary(results):
+    body = {"results": results}
+    for result in results:
+        body[result["status"]] = body.get(result["status"], 0) + 1
+    return body
+
+def commit_chunk(model, results, chunk, status, apply):
+    # chunk is a list of (index, value); if the chunk fails only its own items are marked as errors
+    if not chunk:
+        return
+    try:
+        apply([value for index, value in chunk])
+        db.session.commit()
+        invalidate(model.__tablename__)
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        for index, value in chunk:
+            results[index] = {"index": index, "status": "error", "msg": error.__class__.__name__}
+        return
+    for index, value in chunk:
+        results[index] = {"index": index, "status": status}
+
+def existing_ids(model, ids):
+    return {row.id for row in db.session.query(model.id).filter(model.id.in_(ids))}
+
+def bulk_create(model, data):
+    items = get_bulk_items(data)
+    fields = model_fields(model)
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        missing = [field for field in fields if not isinstance(item, dict) or field not in item]
+        if missing:
+            results[index] = {"index": index, "status": "error", "msg": "Missing fields: " + ", ".join(missing)}
+        else:
+            valid.append((index, {field: item[field] for field in fields}))
+    for chunk in chunks(valid):
+        commit_chunk(model, results, chunk, "created", lambda rows: db.session.execute(insert(model), rows))
+    return summary(results)
+
+def bulk_update(model, data):
+    items = get_bulk_items(data)
+    fields = model_fields(model)
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            results[index] = {"index": index, "status": "error", "msg": "Missing id"}
+            continue
+        values = {field: item[field] for field in fields if field in item}
+        if not values:
+            results[index] = {"index": index, "status": "error", "msg": "Nothing to update"}
+            continue
+        values["id"] = item["id"]
+        valid.append((index, values))
+    for chunk in chunks(valid):
+        found = existing_ids(model, [values["id"] for index, values in chunk])
+        for index, values in chunk:
+            if values["id"] not in found:
+                results[index] = {"index": index, "status": "not_found"}
+        chunk = [(index, values) for index, values in chunk if values["id"] in found]
+        commit_chunk(model, results, chunk, "updated", lambda rows: db.session.bulk_update_mappings(model, rows))
+    return summary(results)
+
+def bulk_delete(model, data):
+    items = get_bulk_items(data)
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        # accepts [1, 2, 3] or [{"id": 1}, {"id": 2}]
+        item_id = item.get("id") if isinstance(item, dict) else item
+        if not isinstance(item_id, int):
+            results[index] = {"index": index, "status": "error", "msg": "Missing id"}
+        else:
+            valid.append((index, item_id))
+    for chunk in chunks(valid):
+        found = existing_ids(model, [item_id for index, item_id in chunk])
+        for index, item_id in chunk:
+            if item_id not in found:
+                results[index] = {"index": index, "status": "not_found"}
+        chunk = [(index, item_id) for index, item_id in chunk if item_id in found]
+        commit_chunk(model, results, chunk, "deleted",
+            lambda ids: model.query.filter(model.id.in_(ids)).delete(synchronize_session=False))
+    return summary(results)
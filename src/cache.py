@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response
+from utils import wants_stream
+from replicas import DATABASE_REPLICA_URLS, primary_reads, reads_from_primary
+
+# read-through cache for the encoded GET responses of the reference data (characters, planets)
+# RESPONSE_CACHE_TTL=0 turns it off
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+# memory:// keeps it inside each process, redis://host:port/db shares it between all the gunicorn workers
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "memory://")
+# there is one version per table and one per user dashboard (dashboard:<id>), so they are bounded
+# and expire too; a lost version is given a value never used before, which only means a miss
+RESPONSE_CACHE_MAX_VERSIONS = int(os.getenv("RESPONSE_CACHE_MAX_VERSIONS", 10000))
+RESPONSE_CACHE_VERSION_TTL = 3600
+
+class LRUCache:
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# a backend stores bytes under string keys and keeps integer counters for the table versions;
+# the counters come from one sequence, so a counter that was evicted never gets an old value back
+
+class MemoryBackend:
+
+    def __init__(self, max_entries, ttl, max_counters=RESPONSE_CACHE_MAX_VERSIONS):
+        self.entries = LRUCache(max_entries, ttl)
+        self.counters = LRUCache(max_counters, RESPONSE_CACHE_VERSION_TTL)
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries.set(key, value)
+
+    def counter(self, key):
+        with self.lock:
+            value = self.counters.get(key)
+            if value is None:
+                value = self.next_value(key)
+            return value
+
+    def incr(self, key):
+        with self.lock:
+            return self.next_value(key)
+
+    def next_value(self, key):
+        self.sequence += 1
+        self.counters.set(key, self.sequence)
+        return self.sequence
+
+# the same on the server: a missing counter takes the next value of the shared sequence
+COUNTER_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    value = redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[1], value, 'PX', ARGV[1])
+end
+return value
+"""
+INCR_SCRIPT = """
+local value = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], value, 'PX', ARGV[1])
+return value
+"""
+
+class RedisBackend:
+    # anything that speaks the redis protocol works (redis, valkey, dragonfly, fakeredis in local)
+    # if the server is down we behave like an empty cache instead of failing the request
+
+    def __init__(self, client, ttl, prefix="swapi:"):
+        import redis
+        self.errors = redis.RedisError
+        self.client = client
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+        self.counter_script = client.register_script(COUNTER_SCRIPT)
+        self.incr_script = client.register_script(INCR_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url, ttl):
+        import redis
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def get(self, key):
+        try:
+            return self.client.get(self.prefix + key)
+        except self.errors:
+            return None
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, value, px=self.ttl_ms)
+        except self.errors:
+            pass
+
+    def counter(self, key):
+        return self.run_counter_script(self.counter_script, key)
+
+    def incr(self, key):
+        return self.run_counter_script(self.incr_script, key)
+
+    def run_counter_script(self, script, key):
+        try:
+            return int(script(keys=[self.prefix + key, self.prefix + "version-sequence"],
+                args=[RESPONSE_CACHE_VERSION_TTL * 1000]))
+        except self.errors:
+            return None
+
+def create_backend(url, max_entries, ttl):
+    if url.startswith("memory://"):
+        return MemoryBackend(max_entries, ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url, ttl)
+    raise ValueError("Unknown RESPONSE_CACHE_URL: %s" % url)
+
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def version(self, table):
+        # None means the backend could not tell us the version, in that case we must not use the cache
+        return self.backend.counter("version:" + table)
+
+    def invalidate(self, table):
+        # entries are keyed by the table version, so bumping it is enough; the old ones expire on their own
+        self.backend.incr("version:" + table)
+
+    def key(self, table, version, path):
+        return "%s:%s:%s" % (table, version, path)
+
+    def get(self, table, version, path):
+        value = self.backend.get(self.key(table, version, path))
+        if value is None:
+            return None
+        etag, mimetype, body = value.split(b"\n", 2)
+        return body, etag.decode(), mimetype.decode()
+
+    def set(self, table, version, path, entry):
+        body, etag, mimetype = entry
+        self.backend.set(self.key(table, version, path), b"\n".join([etag.encode(), mimetype.encode(), body]))
+
+response_cache = ResponseCache(create_backend(RESPONSE_CACHE_URL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL))
+
+# functions called with the table name after each invalidate(), for other copies of the data (shared_snapshot.py)
+invalidate_listeners = []
+
+def on_invalidate(listener):
+    invalidate_listeners.append(listener)
+
+def invalidate(*tables):
+    for table in tables:
+        response_cache.invalidate(table)
+        for listener in invalidate_listeners:
+            listener(table)
+
+def make_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+def cached_response(*tables):
+    # a response that reads several tables depends on all their versions; a table can also be
+    # a function of the view arguments, e.g. lambda id: "dashboard:%d" % id for one entry per user
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if RESPONSE_CACHE_TTL <= 0 or wants_stream():
+                return view(*args, **kwargs)
+            path = request.full_path
+            names = [table(**kwargs) if callable(table) else table for table in tables]
+            # read the versions before running the view, so a write in the middle leaves this entry stale, not wrong
+            versions = [response_cache.version(name) for name in names]
+            if None in versions:
+                return view(*args, **kwargs)
+            table = "+".join(names)
+            version = ".".join(str(version) for version in versions)
+            # with read replicas an entry may come from a lagging replica, a client that just wrote reads the primary
+            if DATABASE_REPLICA_URLS and reads_from_primary():
+                entry = None
+            else:
+                entry = response_cache.get(table, version, path)
+            if entry is None:
+                # the entry is stored under the versions read above, a lagging replica could answer with older rows
+                with primary_reads():
+                    response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = (body, make_etag(body), response.mimetype)
+                response_cache.set(table, version, path, entry)
+            body, etag, mimetype = entry
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, status=200, mimetype=mimetype)
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,242 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, text
+from sqlalchemy.exc import SQLAlchemyError
+from cache import invalidate
+from dashboard import invalidate_dashboards
+from models import db, User, Characters, Planets, Fav_Characters, Fav_Planets
+from popularity import reconcile
+
+# loading and dumping the catalog from files
+#   flask catalog import characters people.csv          (pipenv run catalog-import characters people.csv)
+#   flask catalog export planets planets.ndjson         (pipenv run catalog-export planets planets.ndjson, - is stdout)
+# the files have one row per line (CSV with a header, or NDJSON) with the columns of the table, ids
+# included, so an export imports back as it was and the favorites keep pointing to the same rows.
+# User passwords are left out of the exports unless --with-passwords is given (import needs them).
+# Import reads blocks of --chunk-size lines, a pool of --workers processes parses and types them and
+# every block is one executemany + one commit, in file order. A CSV value can not span several lines.
+# Export reads the table in chunks (yield_per), it never has the whole table in memory.
+CATALOG_CHUNK_SIZE = 5000
+CATALOG_WORKERS = os.cpu_count() or 1
+CATALOG_FORMATS = ("csv", "ndjson")
+CATALOG_MODELS = {
+    "users": User,
+    "characters": Characters,
+    "planets": Planets,
+    "fav_characters": Fav_Characters,
+    "fav_planets": Fav_Planets,
+}
+TRUE_VALUES = ("1", "true", "yes", "t", "y")
+
+catalog_cli = AppGroup("catalog", help="Import and export users, characters, planets and favorites.")
+
+def file_format(path, format):
+    if format:
+        return format
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    raise click.UsageError("Can not tell the format of %s, use --format" % path)
+
+def open_path(path, mode):
+    # - is stdin/stdout; newline="" as the csv module wants
+    if path == "-":
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+def column_types(model):
+    # name -> (python type, nullable, has a default), what the workers need to type the values
+    return {
+        column.name: (column.type.python_type.__name__, column.nullable, column.primary_key or column.default is not None)
+        for column in model.__table__.columns
+    }
+
+def typed(value, type_name, nullable):
+    if value is None or value == "":
+        if nullable:
+            return None
+        if type_name == "str":
+            return ""
+        raise ValueError("a value is required")
+    if not isinstance(value, str):
+        return value
+    if type_name == "int":
+        return int(value)
+    if type_name == "bool":
+        return value.strip().lower() in TRUE_VALUES
+    return value
+
+def parse_block(format, columns, header, first_line, lines):
+    # runs in the worker processes; returns the rows ready for insert(model)
+    values = csv.reader(lines) if format == "csv" else lines
+    rows = []
+    for line, value in enumerate(values, first_line):
+        if format == "csv":
+            record = dict(zip(header, value)) if value else None
+        else:
+            try:
+                record = json.loads(value) if value.strip() else None
+            except ValueError as error:
+                raise ValueError("line %d: %s" % (line, error))
+        if record is None:
+            # empty line
+            continue
+        if not isinstance(record, dict):
+            raise ValueError("line %d: expected an object" % line)
+        row = {}
+        for name, (type_name, nullable, optional) in columns.items():
+            if name not in record:
+                if optional or nullable:
+                    continue
+                raise ValueError("line %d: missing column %s" % (line, name))
+            try:
+                row[name] = typed(record[name], type_name, nullable)
+            except ValueError as error:
+                raise ValueError("line %d, column %s: %s" % (line, name, error))
+        rows.append(row)
+    return rows
+
+def blocks(file, size):
+    # (line number of the first line, lines)
+    line = 1
+    while True:
+        lines = list(islice(file, size))
+        if not lines:
+            return
+        yield line, lines
+        line += len(lines)
+
+def progress(table, rows, started, done=False):
+    # rewritten in place on a terminal, only the last line otherwise
+    if not done and not sys.stderr.isatty():
+        return
+    elapsed = time.perf_counter() - started
+    click.echo("\r%s: %d rows, %.0f rows/s" % (table, rows, rows / elapsed if elapsed else 0),
+        nl=done, err=True)
+
+def reset_sequence(model):
+    # rows imported with their id leave the postgres sequence behind, the next POST would collide
+    if db.session.get_bind().dialect.name == "postgresql":
+        table = model.__tablename__
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), COALESCE(MAX(id), 1)) FROM \"%s\"" % (table, table)
+        ))
+        db.session.commit()
+
+def after_import(model, rows):
+    invalidate(model.__tablename__)
+    if model in (Fav_Characters, Fav_Planets):
+        invalidate_dashboards(row["user_id"] for row in rows if row.get("user_id") is not None)
+
+def import_rows(model, file, format, chunk_size, workers):
+    columns = column_types(model)
+    header = None
+    first_line = 1
+    if format == "csv":
+        header = next(csv.reader([file.readline()]), None)
+        if not header:
+            raise click.ClickException("The CSV file has no header")
+        unknown = set(header) - set(columns)
+        if unknown:
+            raise click.ClickException("Unknown columns: " + ", ".join(sorted(unknown)))
+        first_line = 2
+    table = model.__tablename__
+    imported = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # a few blocks ahead of the inserts, so the file is never read much faster than it is written
+        pending = deque()
+        source = ((first_line + line - 1, lines) for line, lines in blocks(file, chunk_size))
+        for line, lines in islice(source, workers * 2):
+            pending.append((line, pool.submit(parse_block, format, columns, header, line, lines)))
+        while pending:
+            line, future = pending.popleft()
+            for next_line, lines in islice(source, 1):
+                pending.append((next_line, pool.submit(parse_block, format, columns, header, next_line, lines)))
+            try:
+                rows = future.result()
+            except ValueError as error:
+                raise click.ClickException("%s (%d rows imported before it)" % (error, imported))
+            if not rows:
+                continue
+            try:
+                db.session.execute(insert(model), rows)
+                db.session.commit()
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                raise click.ClickException("the block from line %d could not be inserted (%s), %d rows imported before it"
+                    % (line, error.__class__.__name__, imported))
+            after_import(model, rows)
+            imported += len(rows)
+            progress(table, imported, started)
+    progress(table, imported, started, done=True)
+    reset_sequence(model)
+    if model in (Fav_Characters, Fav_Planets):
+        # the favorite counters of /people/top and /planets/top
+        reconcile()
+    return imported
+
+# columns only exported with --with-passwords
+SECRET_COLUMNS = {User: ("password",)}
+
+def export_rows(model, file, format, chunk_size, with_passwords=False):
+    skip = () if with_passwords else SECRET_COLUMNS.get(model, ())
+    names = [column.name for column in model.__table__.columns if column.name not in skip]
+    query = db.session.query(*[getattr(model, name) for name in names]).order_by(model.id).yield_per(chunk_size)
+    dumps = current_app.json.dumps
+    writer = csv.writer(file) if format == "csv" else None
+    if writer:
+        writer.writerow(names)
+    table = model.__tablename__
+    exported = 0
+    started = time.perf_counter()
+    for row in query:
+        if writer:
+            writer.writerow(row)
+        else:
+            file.write(dumps(row._asdict()))
+            file.write("\n")
+        exported += 1
+        if exported % chunk_size == 0:
+            progress(table, exported, started)
+    progress(table, exported, started, done=True)
+    return exported
+
+@catalog_cli.command("import")
+@click.argument("kind", type=click.Choice(list(CATALOG_MODELS)))
+@click.argument("path", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--format", type=click.Choice(CATALOG_FORMATS), help="csv or ndjson, by default from the extension")
+@click.option("--chunk-size", type=click.IntRange(1), default=CATALOG_CHUNK_SIZE, show_default=True,
+    help="rows per insert and commit")
+@click.option("--workers", type=click.IntRange(1), default=CATALOG_WORKERS, show_default=True,
+    help="processes parsing the file")
+def import_command(kind, path, format, chunk_size, workers):
+    """Import the rows of a CSV or NDJSON file (- is stdin)."""
+    format = file_format(path, format) if path != "-" else format or "ndjson"
+    with open_path(path, "r") as file:
+        import_rows(CATALOG_MODELS[kind], file, format, chunk_size, workers)
+
+@catalog_cli.command("export")
+@click.argument("kind", type=click.Choice(list(CATALOG_MODELS)))
+@click.argument("path", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--format", type=click.Choice(CATALOG_FORMATS), help="csv or ndjson, by default from the extension")
+@click.option("--chunk-size", type=click.IntRange(1), default=CATALOG_CHUNK_SIZE, show_default=True,
+    help="rows read from the database at a time")
+@click.option("--with-passwords", is_flag=True, help="include the user passwords, needed to import the users back")
+def export_command(kind, path, format, chunk_size, with_passwords):
+    """Export a table to a CSV or NDJSON file (- is stdout), ordered by id."""
+    format = file_format(path, format) if path != "-" else format or "ndjson"
+    with open_path(path, "w") as file:
+        export_rows(CATALOG_MODELS[kind], file, format, chunk_size, with_passwords)
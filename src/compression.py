@@ -0,0 +1,121 @@
+import gzip
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# negotiated compression of the responses (Accept-Encoding)
+#   COMPRESSION_MIN_SIZE=1024        smaller bodies go as they are, compressing them costs more than it saves
+#   COMPRESSION_ENCODINGS=br,zstd,gzip  the ones we offer, preferred first (br and zstd only if brotli/zstandard are installed)
+#   COMPRESSION_LEVEL_GZIP=6, COMPRESSION_LEVEL_BR=5, COMPRESSION_LEVEL_ZSTD=3
+# a response with an ETag (the cached lists, see cache.py) is content-addressed, so its compressed
+# bytes are kept in the response cache under that ETag and popular lists are compressed only once
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_ENCODINGS = [encoding.strip() for encoding in os.getenv("COMPRESSION_ENCODINGS", "br,zstd,gzip").split(",")
+    if encoding.strip()]
+COMPRESSION_LEVELS = {
+    "gzip": int(os.getenv("COMPRESSION_LEVEL_GZIP", 6)),
+    "br": int(os.getenv("COMPRESSION_LEVEL_BR", 5)),
+    "zstd": int(os.getenv("COMPRESSION_LEVEL_ZSTD", 3)),
+}
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/html", "text/plain")
+
+def available_encodings():
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [encoding for encoding in COMPRESSION_ENCODINGS if installed.get(encoding)]
+
+ENCODINGS = available_encodings()
+
+def negotiate():
+    # our preference among the encodings the client accepts (q=0 means refused)
+    accepted = request.accept_encodings
+    for encoding in ENCODINGS:
+        if accepted[encoding] > 0:
+            return encoding
+    return None
+
+def compress(body, encoding):
+    level = COMPRESSION_LEVELS[encoding]
+    if encoding == "gzip":
+        # mtime=0 so the same body always gives the same bytes
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+def compress_stream(chunks, encoding):
+    # the NDJSON exports: every chunk is flushed so the client keeps receiving rows as they are read
+    level = COMPRESSION_LEVELS[encoding]
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    elif encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+def encoded_etag(etag, encoding):
+    # a strong ETag names exact bytes, each encoding gets its own
+    return "%s-%s" % (etag, encoding)
+
+def setup_compression(app, cache=None):
+    # cache is the ResponseCache whose backend keeps the compressed bodies of responses with an ETag
+    if not ENCODINGS:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        response.vary.add("Accept-Encoding")
+        if (response.status_code != 200 or response.direct_passthrough
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+            return response
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_SIZE:
+            return response
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            tag = encoded_etag(etag, encoding)
+            if request.if_none_match.contains(tag):
+                response.status_code = 304
+                response.set_data(b"")
+                response.set_etag(tag)
+                return response
+            key = "encoded:" + tag
+            compressed = cache.backend.get(key) if cache is not None else None
+            if compressed is None:
+                compressed = compress(body, encoding)
+                if cache is not None:
+                    cache.backend.set(key, compressed)
+            response.set_etag(tag)
+        else:
+            compressed = compress(body, encoding)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
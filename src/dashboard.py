@@ -0,0 +1,57 @@
+from sqlalchemy import select
+from models import db, User, Characters, Planets, Fav_Characters, Fav_Planets
+from cache import invalidate
+from utils import APIException
+
+# /user/<id>/dashboard: the user and its favorites with the character/planet inside, what the front
+# used to get with /user/<id> + /user/<id>/fav_characters + /user/<id>/fav_planets, in two statements:
+#   1. user LEFT JOIN favorite characters JOIN characters
+#   2. favorite planets JOIN planets
+# the cached response depends on the user's favorites (dashboard_table) and on the user, characters
+# and planets tables
+
+def dashboard_table(id):
+    return "dashboard:%d" % id
+
+def invalidate_dashboards(user_ids):
+    # after a favorite write commits
+    invalidate(*[dashboard_table(user_id) for user_id in set(user_ids)])
+
+def columns(model, prefix=""):
+    return [getattr(model, name).label(prefix + name) for name in model.serialize_columns]
+
+def expanded_favorite(row, column, target_model, key):
+    # same shape as Fav_*.serialize_expanded()
+    return {
+        "id": row.favorite_id,
+        "user_id": row.favorite_user_id,
+        column: getattr(row, key + "_id"),
+        key: {name: getattr(row, key + "_" + name) for name in target_model.serialize_columns},
+    }
+
+def dashboard(id):
+    rows = db.session.execute(
+        select(*columns(User), Fav_Characters.id.label("favorite_id"), Fav_Characters.user_id.label("favorite_user_id"),
+            *columns(Characters, "character_"))
+        .select_from(User)
+        .outerjoin(Fav_Characters, Fav_Characters.user_id == User.id)
+        .outerjoin(Characters, Characters.id == Fav_Characters.character_id)
+        .where(User.id == id)
+        .order_by(Fav_Characters.id)
+    ).all()
+    if not rows:
+        raise APIException("Not found", status_code=404)
+    planets = db.session.execute(
+        select(Fav_Planets.id.label("favorite_id"), Fav_Planets.user_id.label("favorite_user_id"),
+            *columns(Planets, "planet_"))
+        .join(Planets, Planets.id == Fav_Planets.planet_id)
+        .where(Fav_Planets.user_id == id)
+        .order_by(Fav_Planets.id)
+    ).all()
+    return {
+        "user": {name: getattr(rows[0], name) for name in User.serialize_columns},
+        # favorites of a character that no longer exists are left out
+        "fav_characters": [expanded_favorite(row, "character_id", Characters, "character")
+            for row in rows if row.character_id is not None],
+        "fav_planets": [expanded_favorite(row, "planet_id", Planets, "planet") for row in planets],
+    }
@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError
+from sqlalchemy import insert, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from popularity import count_favorites
+from dashboard import invalidate_dashboards
+from models import db, User, Characters, Planets, Fav_Characters, Fav_Planets
+
+# optional group commit for the favorites POST/DELETE
+#   FAVORITES_GROUP_COMMIT_MS=5    collect the favorite writes of concurrent requests for 5ms and
+#                                  apply them in one transaction (one fsync instead of one per request)
+#   FAVORITES_GROUP_COMMIT_MAX=256 flush earlier when this many writes are waiting
+# it only helps when a worker serves requests concurrently (gunicorn --threads or gthread workers)
+# a write whose batch failed for any reason (or was not answered in 30s) gets None, the view answers 503
+FAVORITES_GROUP_COMMIT_MS = float(os.getenv("FAVORITES_GROUP_COMMIT_MS", 0))
+FAVORITES_GROUP_COMMIT_MAX = int(os.getenv("FAVORITES_GROUP_COMMIT_MAX", 256))
+FAVORITES_GROUP_COMMIT_RETRIES = 3
+
+# kind -> favorites model, favorite target model, name of the target column
+FAVORITES = {
+    "characters": (Fav_Characters, Characters, "character_id"),
+    "planets": (Fav_Planets, Planets, "planet_id"),
+}
+
+class FavoriteWrite:
+
+    def __init__(self, kind, action, user_id, target_id):
+        self.kind = kind
+        self.action = action
+        self.user_id = user_id
+        self.target_id = target_id
+        self.future = Future()
+
+def existing_ids(model, ids):
+    ids = [id for id in ids if isinstance(id, int)]
+    if not ids:
+        return set()
+    return {row.id for row in db.session.query(model.id).filter(model.id.in_(ids))}
+
+def apply_favorite_writes(writes):
+    # returns True/False for every write, in order; the caller commits
+    results = [False] * len(writes)
+    for kind, (fav_model, target_model, column) in FAVORITES.items():
+        pending = [(index, write) for index, write in enumerate(writes) if write.kind == kind]
+        if not pending:
+            continue
+        users = existing_ids(User, {write.user_id for index, write in pending})
+        targets = existing_ids(target_model, {write.target_id for index, write in pending})
+        if not users or not targets:
+            continue
+        fav_column = getattr(fav_model, column)
+        existing = set(
+            (row[0], row[1]) for row in db.session.query(fav_model.user_id, fav_column)
+                .filter(fav_model.user_id.in_(users), fav_column.in_(targets))
+        )
+        # replay the writes in arrival order, then write only the difference
+        current = set(existing)
+        for index, write in pending:
+            if write.user_id not in users or write.target_id not in targets:
+                continue
+            pair = (write.user_id, write.target_id)
+            if write.action == "add":
+                current.add(pair)
+                results[index] = True
+            elif pair in current:
+                current.discard(pair)
+                results[index] = True
+        inserts = current - existing
+        deletes = existing - current
+        if inserts:
+            db.session.execute(insert(fav_model), [{"user_id": user_id, column: target_id} for user_id, target_id in inserts])
+        if deletes:
+            db.session.query(fav_model).filter(tuple_(fav_model.user_id, fav_column).in_(list(deletes))) \
+                .delete(synchronize_session=False)
+        deltas = Counter(target_id for user_id, target_id in inserts)
+        deltas.subtract(target_id for user_id, target_id in deletes)
+        count_favorites(kind, deltas)
+    return results
+
+class GroupCommitter:
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.enabled = window > 0
+        self.app = None
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def ensure_started(self):
+        # gunicorn forks the workers after importing the app, so the thread is started on first use
+        # (and again in a forked child, threads do not survive a fork)
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name="favorites-group-commit", daemon=True)
+                self.thread.start()
+
+    def submit(self, kind, action, user_id, target_id, timeout=30):
+        self.ensure_started()
+        try:
+            target_id = int(target_id)
+        except (TypeError, ValueError):
+            return False
+        write = FavoriteWrite(kind, action, user_id, target_id)
+        self.queue.put(write)
+        try:
+            return write.future.result(timeout=timeout)
+        except (TimeoutError, SQLAlchemyError):
+            return None
+        except Exception:
+            # run() hands any failure of the batch to every request in it, a bug included
+            self.app.logger.exception("favorites group commit failed")
+            return None
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        try:
+            self.commit(batch)
+        except Exception as error:
+            # never leave a request waiting for an answer that will not come
+            for write in batch:
+                if not write.future.done():
+                    write.future.set_exception(error)
+
+    def commit(self, batch):
+        error = None
+        with self.app.app_context():
+            # a concurrent writer from another worker can hit the unique index; the retry reads it back
+            for attempt in range(FAVORITES_GROUP_COMMIT_RETRIES):
+                try:
+                    results = apply_favorite_writes(batch)
+                    db.session.commit()
+                    break
+                except SQLAlchemyError as exception:
+                    db.session.rollback()
+                    error = exception
+            else:
+                for write in batch:
+                    write.future.set_exception(error)
+                return
+        invalidate_dashboards(write.user_id for write, result in zip(batch, results) if result)
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+favorites_group_commit = GroupCommitter(FAVORITES_GROUP_COMMIT_MS / 1000, FAVORITES_GROUP_COMMIT_MAX)
@@ -0,0 +1,27 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class ORJSONProvider(DefaultJSONProvider):
+    # encoded with orjson when it is installed: same keys, key order and indentation as flask's default
+    # provider, but orjson has no ensure_ascii, so "Añadido" goes out as UTF-8 instead of "A\u00f1adido"
+    # (the same JSON for any client). Any option orjson does not understand goes to the stdlib json as before.
+    # Only installed with FAST_SERIALIZATION=1 (app.py)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {"separators", "indent"}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
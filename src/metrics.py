@@ -0,0 +1,227 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import g, request, Response, has_request_context
+from sqlalchemy import event
+from models import db
+from pool import pool_stats
+
+# opt-in request instrumentation, exposed in prometheus text format on /metrics
+#   METRICS_ENABLED=1               latency histograms, SQL statements/time and JSON encoding time per endpoint,
+#                                   and the requests rejected by the rate limits (rate_limited_total)
+#   PROFILE_SLOW_REQUEST_MS=500     also sample the stacks of every request and dump the ones slower than that
+#   PROFILE_INTERVAL_MS=5           sampling interval
+#   PROFILE_DIR=/tmp/profiles       where the .folded files go (flamegraph.pl / speedscope format)
+# the numbers are per process, with several gunicorn workers each one reports its own
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+PROFILE_SLOW_REQUEST_MS = os.getenv("PROFILE_SLOW_REQUEST_MS")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.responses = Counter()
+        self.sql_statements = Counter()
+        self.sql_seconds = Counter()
+        self.serialization_seconds = Counter()
+        self.rate_limited = Counter()
+
+    def record(self, endpoint, method, status, seconds, sql_statements, sql_seconds, serialization_seconds):
+        with self.lock:
+            self.latency[(endpoint, method)].observe(seconds)
+            self.responses[(endpoint, method, status)] += 1
+            self.sql_statements[(endpoint, method)] += sql_statements
+            self.sql_seconds[(endpoint, method)] += sql_seconds
+            self.serialization_seconds[(endpoint, method)] += serialization_seconds
+
+    def record_rate_limited(self, endpoint, method, status):
+        with self.lock:
+            self.rate_limited[(endpoint, method, status)] += 1
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, help):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        with self.lock:
+            header("http_request_duration_seconds", "histogram", "Request latency by endpoint.")
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                labels = 'endpoint="%s",method="%s"' % (endpoint, method)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('http_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append('http_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+                lines.append("http_request_duration_seconds_sum{%s} %f" % (labels, histogram.sum))
+                lines.append("http_request_duration_seconds_count{%s} %d" % (labels, histogram.count))
+            header("http_responses_total", "counter", "Responses by endpoint and status code.")
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append('http_responses_total{endpoint="%s",method="%s",status="%d"} %d' % (endpoint, method, status, count))
+            header("rate_limited_total", "counter", "Requests rejected by the rate/concurrency limits (429/503).")
+            for (endpoint, method, status), count in sorted(self.rate_limited.items()):
+                lines.append('rate_limited_total{endpoint="%s",method="%s",status="%d"} %d' % (endpoint, method, status, count))
+            for name, values, help in (
+                ("db_statements_total", self.sql_statements, "SQL statements executed by endpoint."),
+                ("db_statement_duration_seconds_total", self.sql_seconds, "Time spent in SQL by endpoint."),
+                ("serialization_duration_seconds_total", self.serialization_seconds, "Time spent encoding JSON by endpoint."),
+            ):
+                header(name, "counter", help)
+                for (endpoint, method), value in sorted(values.items()):
+                    lines.append('%s{endpoint="%s",method="%s"} %s' % (name, endpoint, method, value))
+
+        pool = pool_stats.to_dict()
+        for key in ("checkouts", "connects", "invalidated", "timeouts", "wait_seconds_total"):
+            header("db_pool_%s" % key, "counter", "Connection pool %s." % key.replace("_", " "))
+            lines.append("db_pool_%s %s" % (key, pool[key]))
+        for key in ("size", "checked_out", "overflow"):
+            if key in pool:
+                header("db_pool_%s" % key, "gauge", "Connection pool %s." % key.replace("_", " "))
+                lines.append("db_pool_%s %s" % (key, pool[key]))
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+class SamplingProfiler:
+    # one background thread looks at the stack of every thread that is serving a request,
+    # the samples of a request are written only if it ends up being slow
+
+    def __init__(self, interval, threshold, directory):
+        self.interval = interval
+        self.threshold = threshold
+        self.directory = directory
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            self.active[threading.get_ident()] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+                self.thread.start()
+
+    def stop(self, name, seconds):
+        with self.lock:
+            samples = self.active.pop(threading.get_ident(), None)
+        if samples and seconds >= self.threshold:
+            self.dump(name, seconds, samples)
+
+    def discard(self):
+        # the request failed before after_request
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, samples in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[collapse_stack(frame)] += 1
+
+    def dump(self, name, seconds, samples):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = "%d-%s-%dms.folded" % (time.time() * 1000, name, seconds * 1000)
+        with open(os.path.join(self.directory, filename), "w") as file:
+            for stack, count in samples.items():
+                file.write("%s %d\n" % (stack, count))
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def setup_metrics(app):
+    if not METRICS_ENABLED:
+        return
+    profiler = None
+    if PROFILE_SLOW_REQUEST_MS:
+        profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000, float(PROFILE_SLOW_REQUEST_MS) / 1000, PROFILE_DIR)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["metrics_start"].pop()
+        if has_request_context() and "metrics_start" in g:
+            g.sql_statements += 1
+            g.sql_seconds += seconds
+
+    # jsonify and the NDJSON export go through app.json.dumps, timing it gives the encoding cost
+    dumps = app.json.dumps
+
+    def timed_dumps(obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return dumps(obj, **kwargs)
+        finally:
+            if has_request_context() and "metrics_start" in g:
+                g.serialization_seconds += time.perf_counter() - start
+
+    app.json.dumps = timed_dumps
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+        g.serialization_seconds = 0.0
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "metrics_start" not in g:
+            # the rate limits answer before start_request_metrics runs (they are registered first)
+            if g.get("rate_limited"):
+                request_metrics.record_rate_limited(request.endpoint, request.method, response.status_code)
+            return response
+        seconds = time.perf_counter() - g.metrics_start
+        # the view name, not the url, so /people/1 and /people/2 end up in the same series
+        endpoint = request.endpoint or "unmatched"
+        request_metrics.record(endpoint, request.method, response.status_code, seconds,
+            g.sql_statements, g.sql_seconds, g.serialization_seconds)
+        if profiler is not None:
+            profiler.stop(endpoint, seconds)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(error):
+        if profiler is not None:
+            profiler.discard()
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     
@@ -15,6 +16,9 @@ class User(db.Model):
         return '<User %r>' % self.name
         
 
+    # the columns serialize() returns, so list endpoints can select them as plain tuples
+    serialize_columns = ("id", "name", "lastname", "email")
+
     def serialize(self):
         return {
             "id": self.id,
@@ -29,14 +33,19 @@ class Characters(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=False, nullable=False)
     birthday_year = db.Column(db.Integer, unique=False, nullable=False)
-    gender = db.Column(db.String(50), unique=False, nullable=False)
+    gender = db.Column(db.String(50), unique=False, nullable=False, index=True)
     height = db.Column(db.Integer, unique=False, nullable=False)
     skin_color = db.Column(db.String(50), unique=False, nullable=False)
-    eye_color = db.Column(db.String(50), unique=False, nullable=False)
+    eye_color = db.Column(db.String(50), unique=False, nullable=False, index=True)
 
     def __repr__(self):
         return '<Characters %r>' % self.name
 
+    serialize_columns = ("id", "name", "birthday_year", "gender", "height", "skin_color", "eye_color")
+    # what /people accepts in ?filter[...]= and ?sort=
+    filter_columns = ("name", "birthday_year", "gender", "height", "skin_color", "eye_color")
+    sort_columns = ("id", "name", "birthday_year", "height")
+
     def serialize(self):
         return {
             "id": self.id, 
@@ -53,13 +62,17 @@ class Characters(db.Model):
 class Planets (db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=False, nullable=False)
-    diameter = db.Column(db.Integer, unique=False, nullable=False)
+    diameter = db.Column(db.Integer, unique=False, nullable=False, index=True)
     rotation_period = db.Column(db.Integer, unique=False, nullable=False)
     orbital_period = db.Column(db.Integer, unique=False, nullable=False)
 
     def __repr__(self):
         return '<Planets %r>' % self.name
 
+    serialize_columns = ("id", "name", "diameter", "rotation_period", "orbital_period")
+    filter_columns = ("name", "diameter", "rotation_period", "orbital_period")
+    sort_columns = ("id", "name", "diameter", "rotation_period", "orbital_period")
+
     def serialize(self):
         return {
             "id": self.id, 
@@ -70,6 +83,10 @@ class Planets (db.Model):
         }
 
 class Fav_Characters (db.Model):
+    # one row per user/character; user_id is the leading column so it also serves the "favorites of a user" lookups
+    __table_args__ = (
+        db.Index('ix_fav__characters_user_id_character_id', 'user_id', 'character_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id  = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship(User)
@@ -86,8 +103,16 @@ class Fav_Characters (db.Model):
             "character_id": self.character_id,
         }
 
+    def serialize_expanded(self):
+        result = self.serialize()
+        result["character"] = self.character.serialize() if self.character else None
+        return result
+
 
 class Fav_Planets (db.Model):
+    __table_args__ = (
+        db.Index('ix_fav__planets_user_id_planet_id', 'user_id', 'planet_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id  = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship(User)
@@ -104,3 +129,31 @@ class Fav_Planets (db.Model):
             "planet_id": self.planet_id,
         }
 
+    def serialize_expanded(self):
+        result = self.serialize()
+        result["planet"] = self.planet.serialize() if self.planet else None
+        return result
+
+
+class Popular_Characters (db.Model):
+    # how many users have each character as favorite, kept up to date by the favorite POST/DELETE
+    # (popularity.py); the index serves /people/top reading only the first rows
+    __table_args__ = (
+        db.Index('ix_popular__characters_favorites', 'favorites', 'character_id'),
+    )
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id', ondelete='CASCADE'), primary_key=True)
+    favorites = db.Column(db.Integer, unique=False, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Popular_Characters %r>' % self.character_id
+
+
+class Popular_Planets (db.Model):
+    __table_args__ = (
+        db.Index('ix_popular__planets_favorites', 'favorites', 'planet_id'),
+    )
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id', ondelete='CASCADE'), primary_key=True)
+    favorites = db.Column(db.Integer, unique=False, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Popular_Planets %r>' % self.planet_id
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+# connection pool settings for server databases (postgres, mysql)
+#   DB_POOL_SIZE        connections kept open per worker (default 5)
+#   DB_MAX_OVERFLOW     extra connections allowed on peaks (default 10)
+#   DB_POOL_TIMEOUT     seconds a request waits for a free connection before failing (default 30)
+#   DB_POOL_RECYCLE     seconds after which a connection is reopened, below the server idle timeout (default 300)
+#   DB_POOL_PRE_PING    1 to test the connection on checkout and replace it if it died (default 1)
+#
+# sqlite file databases get a performance profile instead, applied to every new connection
+#   SQLITE_TUNING=0            keep the stock sqlite settings (rollback journal, no mmap, one connection per request)
+#   SQLITE_JOURNAL_MODE=WAL    readers do not block the writer and the writer does not block readers
+#   SQLITE_SYNCHRONOUS=NORMAL  fsync on checkpoints only, safe with WAL (a power loss can drop the last commits)
+#   SQLITE_MMAP_SIZE           bytes of the file read through mmap (default 256MB)
+#   SQLITE_CACHE_SIZE          page cache per connection, negative is KiB (default -65536, 64MB)
+#   SQLITE_BUSY_TIMEOUT_MS     how long a writer waits for the lock before "database is locked" (default 5000)
+#   SQLITE_STATEMENT_CACHE     prepared statements kept per connection (default 256)
+# the connections are kept in a pool (DB_POOL_SIZE / DB_MAX_OVERFLOW) so the caches survive between requests
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") == "1"
+SQLITE_PRAGMAS = (
+    ("journal_mode", os.getenv("SQLITE_JOURNAL_MODE", "WAL")),
+    ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),
+    ("mmap_size", int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))),
+    ("cache_size", int(os.getenv("SQLITE_CACHE_SIZE", -65536))),
+    ("busy_timeout", int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))),
+    ("temp_store", "MEMORY"),
+)
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", 256))
+
+def is_sqlite_file(url):
+    # sqlite:// and sqlite:///:memory: are one database per connection, a pool of them would not share data
+    return url.startswith("sqlite") and not url.split("?")[0].endswith((":memory:", "sqlite://"))
+
+def engine_options(url):
+    if url.startswith("sqlite"):
+        if not SQLITE_TUNING or not is_sqlite_file(url):
+            return {}
+        return {
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            "connect_args": {
+                # a pooled connection is used by different threads, one at a time
+                "check_same_thread": False,
+                "cached_statements": SQLITE_STATEMENT_CACHE,
+                "timeout": dict(SQLITE_PRAGMAS)["busy_timeout"] / 1000,
+            },
+        }
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 300)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+def apply_sqlite_profile(engine):
+    # also used for the aiosqlite engine of asgi.py (engine.sync_engine)
+    if not SQLITE_TUNING or engine.dialect.name != "sqlite" or not is_sqlite_file(str(engine.url)):
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        cursor.close()
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidated = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.wait_max_seconds = 0.0
+
+    def increment(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            self.wait_count += 1
+            self.wait_seconds += seconds
+            self.wait_max_seconds = max(self.wait_max_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def attach(self, engine):
+        # the listeners stay on the pool when the engine recreates it (dispose), so we keep the engine
+        self.engine = engine
+        event.listen(engine.pool, "connect", lambda *args: self.increment("connects"))
+        event.listen(engine.pool, "checkout", lambda *args: self.increment("checkouts"))
+        event.listen(engine.pool, "checkin", lambda *args: self.increment("checkins"))
+        event.listen(engine.pool, "invalidate", lambda *args: self.increment("invalidated"))
+
+    def to_dict(self):
+        pool = self.engine.pool if self.engine is not None else None
+        with self.lock:
+            stats = {
+                "pool": pool.__class__.__name__ if pool is not None else None,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidated": self.invalidated,
+                "timeouts": self.timeouts,
+                "wait_count": self.wait_count,
+                "wait_seconds_total": round(self.wait_seconds, 6),
+                "wait_seconds_max": round(self.wait_max_seconds, 6),
+            }
+        if isinstance(pool, QueuePool):
+            # overflow() is negative while the pool has not opened all its pool_size connections yet
+            stats.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            })
+        return stats
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool that measures how long each checkout waited for a free connection
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
@@ -0,0 +1,77 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Characters, Planets, Fav_Characters, Fav_Planets, Popular_Characters, Popular_Planets
+from utils import APIException, get_int_arg, serialize_row
+
+# "most favorited" leaderboards (/people/top, /planets/top)
+# popular__characters / popular__planets keep one counter per character/planet, changed in the same
+# transaction as the favorite itself, so a top-K is an index scan of K rows instead of a GROUP BY
+# over all the favorites. `flask reconcile-popularity` rebuilds them from the favorites tables.
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+
+# kind -> counter model, its target column, favorites model, target model
+POPULARITY = {
+    "characters": (Popular_Characters, "character_id", Fav_Characters, Characters),
+    "planets": (Popular_Planets, "planet_id", Fav_Planets, Planets),
+}
+
+def upsert_counter(model, column, target_id, delta):
+    dialect = db.session.get_bind().dialect.name
+    if delta > 0 and dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = dialect_insert(model).values(**{column: target_id, "favorites": delta})
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[column], set_={"favorites": model.favorites + statement.excluded.favorites}
+        ))
+        return
+    result = db.session.execute(
+        update(model).where(getattr(model, column) == target_id).values(favorites=model.favorites + delta)
+    )
+    # a favorite that is being removed was counted when it was added, only new counters are inserted
+    if result.rowcount == 0 and delta > 0:
+        db.session.execute(insert(model).values(**{column: target_id, "favorites": delta}))
+
+def count_favorites(kind, deltas):
+    # deltas is {character/planet id: +n/-n}; the caller commits, together with the favorites
+    model, column, fav_model, target_model = POPULARITY[kind]
+    for target_id, delta in sorted(deltas.items()):
+        if delta:
+            upsert_counter(model, column, target_id, delta)
+
+def top(kind):
+    limit = get_int_arg("limit", TOP_DEFAULT_LIMIT)
+    if limit < 1 or limit > TOP_MAX_LIMIT:
+        raise APIException("'limit' must be between 1 and %d" % TOP_MAX_LIMIT, status_code=400)
+    model, column, fav_model, target_model = POPULARITY[kind]
+    target_id = getattr(model, column)
+    # ties go to the newest id, so both columns run backwards on the (favorites, id) index
+    statement = (
+        select(*[getattr(target_model, name) for name in target_model.serialize_columns], model.favorites)
+        .join(target_model, target_model.id == target_id)
+        .where(model.favorites > 0)
+        .order_by(model.favorites.desc(), target_id.desc())
+        .limit(limit)
+    )
+    return [serialize_row(row) for row in db.session.execute(statement)]
+
+def reconcile():
+    # counts again from the favorites, in one transaction; returns the rows written per kind
+    written = {}
+    for kind, (model, column, fav_model, target_model) in POPULARITY.items():
+        fav_column = getattr(fav_model, column)
+        db.session.execute(delete(model))
+        counts = select(fav_column, func.count()).where(fav_column.isnot(None)).group_by(fav_column)
+        result = db.session.execute(insert(model).from_select([column, "favorites"], counts))
+        written[kind] = result.rowcount
+    db.session.commit()
+    return written
+
+@click.command("reconcile-popularity")
+@with_appcontext
+def reconcile_popularity_command():
+    """Rebuild the favorite counters of /people/top and /planets/top."""
+    for kind, rows in reconcile().items():
+        click.echo("%s: %d counters" % (kind, rows))
@@ -0,0 +1,240 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request, jsonify
+
+# admission control per route (flask endpoint) and client, so one client flooding the list scans or
+# the favorite writes gets rejected right away instead of queueing in front of everybody else
+#   RATE_LIMITS=get_characters=5:10,add_fav_character=2,*=50:100
+#       token bucket: <rate> requests per second, bursts of up to <burst> (default the rate);
+#       over it the answer is 429 with Retry-After = seconds until the next token
+#   CONCURRENCY_LIMITS=get_characters=2,get_planets=2
+#       requests of a client to that endpoint being processed at the same time; over it the answer
+#       is 503 with Retry-After: 1, the request never reaches the view
+#   * is every endpoint without its own rule
+#   RATE_LIMIT_KEY_HEADER=X-Api-Key    the client is the first value of that header (e.g. X-Forwarded-For
+#                                      behind a proxy), the remote address if it is missing
+#   RATE_LIMIT_URL=memory://           the counters of each process, with N workers a client gets up to N times
+#                                      the limits; redis://host:port/db shares them between all the workers
+# if redis is down the requests are let through, like the response cache does
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+CONCURRENCY_LIMITS = os.getenv("CONCURRENCY_LIMITS", "")
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "memory://")
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 10000))
+CONCURRENCY_RETRY_AFTER = 1
+# a slot that was never released (a worker killed in the middle of a request) frees itself after this
+CONCURRENCY_SLOT_TTL = 60
+
+def parse_rules(spec, parse):
+    # "endpoint=value,endpoint=value" -> {endpoint: parse(value)}
+    rules = {}
+    for rule in spec.split(","):
+        if not rule.strip():
+            continue
+        endpoint, separator, value = rule.partition("=")
+        if not separator:
+            raise ValueError("Rate limit rules are endpoint=value: %s" % rule)
+        rules[endpoint.strip()] = parse(value.strip())
+    return rules
+
+def parse_rate(value):
+    # "rate[:burst]" -> (tokens per second, bucket size)
+    rate, separator, burst = value.partition(":")
+    rate = float(rate)
+    burst = float(burst) if separator else max(rate, 1)
+    if rate <= 0 or burst < 1:
+        raise ValueError("A rate limit needs rate > 0 and burst >= 1: %s" % value)
+    return rate, burst
+
+def parse_concurrency(value):
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("A concurrency limit must be at least 1: %s" % value)
+    return limit
+
+# a backend answers take() with the seconds to wait for a token (0 means allowed)
+# and acquire()/release() for the requests in progress
+
+class MemoryBackend:
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        # key -> [tokens, monotonic time of the last update]; the oldest clients are forgotten first,
+        # which only gives them a full bucket again
+        self.buckets = OrderedDict()
+        self.in_progress = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [burst, now]
+                while len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def acquire(self, key, limit):
+        with self.lock:
+            count = self.in_progress.get(key, 0)
+            if count >= limit:
+                return False
+            self.in_progress[key] = count + 1
+            return True
+
+    def release(self, key):
+        with self.lock:
+            count = self.in_progress.get(key, 0) - 1
+            if count > 0:
+                self.in_progress[key] = count
+            else:
+                self.in_progress.pop(key, None)
+
+# refill and take in one step on the server, with the server clock, so all the workers see the same bucket
+TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisBackend:
+
+    def __init__(self, client, prefix="swapi:limit:"):
+        import redis
+        self.errors = redis.RedisError
+        self.client = client
+        self.prefix = prefix
+        self.take_script = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, rate, burst):
+        try:
+            return float(self.take_script(keys=[self.prefix + "rate:" + key], args=[rate, burst]))
+        except self.errors:
+            return 0
+
+    def acquire(self, key, limit):
+        key = self.prefix + "concurrency:" + key
+        try:
+            with self.client.pipeline() as pipeline:
+                count, expire = pipeline.incr(key).expire(key, CONCURRENCY_SLOT_TTL).execute()
+            if count > limit:
+                self.client.decr(key)
+                return False
+        except self.errors:
+            pass
+        return True
+
+    def release(self, key):
+        try:
+            self.client.decr(self.prefix + "concurrency:" + key)
+        except self.errors:
+            pass
+
+def create_backend(url, max_clients):
+    if url.startswith("memory://"):
+        return MemoryBackend(max_clients)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    raise ValueError("Unknown RATE_LIMIT_URL: %s" % url)
+
+def rule_for(rules, endpoint):
+    return rules.get(endpoint, rules.get("*"))
+
+class RateLimiter:
+
+    def __init__(self, rates, concurrency, key_header, backend):
+        self.rates = rates
+        self.concurrency = concurrency
+        self.key_header = key_header
+        self.backend = backend
+        self.enabled = bool(rates or concurrency)
+
+    def client_key(self):
+        if self.key_header:
+            value = request.headers.get(self.key_header, "").split(",")[0].strip()
+            if value:
+                return value
+        return request.remote_addr or "unknown"
+
+    def applies(self, endpoint):
+        return self.enabled and (rule_for(self.rates, endpoint) is not None
+            or rule_for(self.concurrency, endpoint) is not None)
+
+    def admit(self):
+        # None if the request goes on, otherwise the 429/503 response
+        endpoint = request.endpoint
+        if endpoint is None or request.method == "OPTIONS" or not self.applies(endpoint):
+            return None
+        key = "%s:%s" % (endpoint, self.client_key())
+        rate = rule_for(self.rates, endpoint)
+        if rate is not None:
+            wait = self.backend.take(key, *rate)
+            if wait > 0:
+                return self.reject(429, "Too many requests, slow down", math.ceil(wait))
+        limit = rule_for(self.concurrency, endpoint)
+        if limit is not None:
+            if not self.backend.acquire(key, limit):
+                return self.reject(503, "Too many requests in progress", CONCURRENCY_RETRY_AFTER)
+            g.concurrency_key = key
+        return None
+
+    def release(self):
+        key = g.pop("concurrency_key", None)
+        if key is not None:
+            self.backend.release(key)
+
+    def reject(self, status, message, retry_after):
+        # counted in rate_limited_total when METRICS_ENABLED=1 (metrics.py)
+        g.rate_limited = True
+        response = jsonify({"message": message})
+        response.status_code = status
+        response.headers["Retry-After"] = str(max(1, retry_after))
+        return response
+
+rate_limiter = RateLimiter(
+    parse_rules(RATE_LIMITS, parse_rate),
+    parse_rules(CONCURRENCY_LIMITS, parse_concurrency),
+    RATE_LIMIT_KEY_HEADER,
+    create_backend(RATE_LIMIT_URL, RATE_LIMIT_MAX_CLIENTS),
+)
+
+def setup_rate_limits(app):
+    if not rate_limiter.enabled:
+        return
+
+    @app.before_request
+    def admit_request():
+        return rate_limiter.admit()
+
+    @app.teardown_request
+    def release_request(error=None):
+        rate_limiter.release()
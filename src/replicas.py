@@ -0,0 +1,73 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# optional read replicas
+#   DATABASE_REPLICA_URLS=postgresql://replica1/db,postgresql://replica2/db
+#   READ_YOUR_WRITES_SECONDS=5    after a write the same client reads from the primary for this long
+# GET/HEAD requests read from a random replica, everything else (and every flush) uses DATABASE_URL.
+# The stickiness is a cookie set on the response of every successful write, so a client that
+# just created or changed something does not read an older copy of it from a lagging replica.
+# What is kept beyond the request under a table version (the response cache, the reference snapshot)
+# is read inside primary_reads(), a replica behind that version would fill it with older data.
+# Two local sqlite files work for testing, the replica being a copy of the primary:
+#   sqlite3 /tmp/test.db ".backup /tmp/replica.db"
+#   DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db
+DATABASE_REPLICA_URLS = [url.strip().replace("postgres://", "postgresql://")
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+REPLICA_BIND_PREFIX = "replica_"
+READ_METHODS = ("GET", "HEAD")
+
+def replica_binds(engine_options):
+    # replicas are flask-sqlalchemy binds without models, create_all and the migrations ignore them
+    return {
+        "%s%d" % (REPLICA_BIND_PREFIX, index): dict(engine_options(url), url=url)
+        for index, url in enumerate(DATABASE_REPLICA_URLS)
+    }
+
+def reads_from_primary():
+    if not has_request_context():
+        return True
+    if request.method not in READ_METHODS or g.get("read_primary"):
+        return True
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+@contextmanager
+def primary_reads():
+    previous = g.get("read_primary", False)
+    g.read_primary = True
+    try:
+        yield
+    finally:
+        g.read_primary = previous
+
+class RoutingSession(Session):
+    # db.session picks a replica for the reads of GET/HEAD requests, the primary for the rest
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not reads_from_primary():
+            replicas = [engine for key, engine in self._db.engines.items()
+                if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def setup_replicas(app):
+    if not DATABASE_REPLICA_URLS:
+        return
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in READ_METHODS and request.method != "OPTIONS" and response.status_code < 400:
+            until = time.time() + READ_YOUR_WRITES_SECONDS
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, "%.3f" % until, max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,71 @@
+import os
+import re
+from sqlalchemy import text
+from models import db
+from utils import APIException, get_int_arg
+
+# typeahead over characters.name and planets.name
+# sqlite: FTS5 tables (characters_fts, planets_fts) kept in sync by triggers, prefix queries use the prefix index
+# postgres: pg_trgm GIN indexes on the name columns, so ILIKE '%q%' does not scan the table
+# the tables, triggers and indexes are created in migration 9a4f6b1e3c70
+# only the first SEARCH_CANDIDATES matches the index returns (id order in sqlite) are ranked: a short prefix like "l" matches
+# most of the table and ranking all of it costs hundreds of ms at 1M rows (benchmarks/search_latency.py)
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 500))
+SEARCH_TABLES = {"people": "characters", "planets": "planets"}
+
+def include_object(object, name, type_, reflected, compare_to):
+    # those objects are not in the models, autogenerate must not try to drop them
+    if reflected and compare_to is None:
+        if type_ == "table" and re.match(r"(characters|planets)_fts", name):
+            return False
+        if type_ == "index" and name.endswith("_trgm"):
+            return False
+    return True
+
+def fts_query(q):
+    # every word becomes a quoted prefix term: luke sky -> "luke"* "sky"*
+    words = re.findall(r"\w+", q)
+    return " ".join('"%s"*' % word for word in words)
+
+def like_pattern(q):
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+SQLITE_SEARCH = (
+    "SELECT id, name FROM (SELECT rowid AS id, name, rank FROM {table}_fts WHERE {table}_fts MATCH :match "
+    "LIMIT :candidates) ORDER BY rank LIMIT :limit"
+)
+POSTGRESQL_SEARCH = (
+    "SELECT id, name FROM (SELECT id, name FROM {table} WHERE name ILIKE :pattern LIMIT :candidates) AS candidates "
+    "ORDER BY similarity(name, :q) DESC, id LIMIT :limit"
+)
+
+def search_table(table, q, limit):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = fts_query(q)
+        if not match:
+            return []
+        sql = text(SQLITE_SEARCH.format(table=table))
+        params = {"match": match, "candidates": max(limit, SEARCH_CANDIDATES), "limit": limit}
+    elif dialect == "postgresql":
+        sql = text(POSTGRESQL_SEARCH.format(table=table))
+        params = {"pattern": like_pattern(q), "q": q, "candidates": max(limit, SEARCH_CANDIDATES), "limit": limit}
+    else:
+        # no special index, a prefix LIKE is the best we can do
+        sql = text("SELECT id, name FROM %s WHERE name LIKE :pattern ORDER BY name LIMIT :limit" % table)
+        params = {"pattern": q.replace("%", "").replace("_", "") + "%", "limit": limit}
+    return [{"id": row.id, "name": row.name} for row in db.session.execute(sql, params)]
+
+def search(q, kind=None):
+    q = (q or "").strip()
+    if not q:
+        raise APIException("'q' is required", status_code=400)
+    limit = get_int_arg("limit", SEARCH_DEFAULT_LIMIT)
+    if limit < 1 or limit > SEARCH_MAX_LIMIT:
+        raise APIException("'limit' must be between 1 and %d" % SEARCH_MAX_LIMIT, status_code=400)
+    if kind is not None and kind not in SEARCH_TABLES:
+        raise APIException("'type' must be one of: " + ", ".join(SEARCH_TABLES), status_code=400)
+    kinds = [kind] if kind else list(SEARCH_TABLES)
+    return {name: search_table(SEARCH_TABLES[name], q, limit) for name in kinds}
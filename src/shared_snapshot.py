@@ -0,0 +1,252 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from flask import request, Response
+from boot import running_command
+from models import db, Characters, Planets
+from utils import get_page_params, is_paginated_request, serialize_row, wants_stream
+
+# encoded /people and /planets kept in one file per table that every worker memory-maps
+#   SHARED_SNAPSHOT_DIR=/tmp/swapi-snapshots   turns it on; the files are <table>.snap in there
+# the file holds the JSON array of the whole table and, sorted by id, where every row starts and
+# ends in it, so the list, a page (?limit=&after=) and a single row are slices of the same bytes.
+# The pages live in the OS page cache once for all the workers, nothing is encoded per request.
+# After a write (cache.invalidate) a background thread builds a new file next to it and renames it
+# over the old one; the workers notice the new inode and map it. Until the new file is there, the
+# worker that did the write answers from the database so it reads what it wrote.
+SHARED_SNAPSHOT_DIR = os.getenv("SHARED_SNAPSHOT_DIR")
+SNAPSHOT_MAGIC = b"SWSNAP01"
+# magic, version, rows, body offset, body length, index offset
+SNAPSHOT_HEADER = struct.Struct("<8sqqqqq")
+BUILD_CHUNK_SIZE = 10000
+# endpoint -> model, and if it is the view of one row
+SNAPSHOT_ENDPOINTS = {
+    "get_characters": (Characters, False),
+    "get_character": (Characters, True),
+    "get_planets": (Planets, False),
+    "get_planet": (Planets, True),
+}
+
+def snapshot_path(directory, model):
+    return os.path.join(directory, "%s.snap" % model.__tablename__)
+
+def read_version(path):
+    # time the file's build started, 0 if there is none
+    try:
+        with open(path, "rb") as file:
+            magic, version = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))[:2]
+    except (FileNotFoundError, struct.error):
+        return 0
+    return version if magic == SNAPSHOT_MAGIC else 0
+
+def write_snapshot(path, model, dumps):
+    # rows ordered by id, encoded one by one; the index goes after the body, 8-byte aligned.
+    # The version is the time the build started, so it includes every write committed before it
+    version = time.time_ns()
+    directory = os.path.dirname(path)
+    ids, offsets, lengths = array("q"), array("q"), array("q")
+    query = db.session.query(*[getattr(model, name) for name in model.serialize_columns]) \
+        .order_by(model.id).yield_per(BUILD_CHUNK_SIZE)
+    file = tempfile.NamedTemporaryFile(dir=directory, prefix=".%s-" % model.__tablename__, delete=False)
+    try:
+        file.write(b"\0" * SNAPSHOT_HEADER.size)
+        body_offset = file.tell()
+        file.write(b"[")
+        position = 1
+        for row in query:
+            encoded = dumps(serialize_row(row)).encode()
+            if ids:
+                file.write(b",")
+                position += 1
+            ids.append(row.id)
+            offsets.append(position)
+            lengths.append(len(encoded))
+            file.write(encoded)
+            position += len(encoded)
+        file.write(b"]")
+        body_length = position + 1
+        file.write(b"\0" * (-(body_offset + body_length) % 8))
+        index_offset = file.tell()
+        for column in (ids, offsets, lengths):
+            column.tofile(file)
+        file.seek(0)
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, version, len(ids), body_offset, body_length, index_offset))
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        os.replace(file.name, path)
+    except BaseException:
+        file.close()
+        os.unlink(file.name)
+        raise
+
+class MappedSnapshot:
+    __slots__ = ("key", "map", "version", "count", "body", "ids", "offsets", "lengths")
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            self.key = (stat.st_ino, stat.st_mtime_ns)
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, body_offset, body_length, index_offset = \
+            SNAPSHOT_HEADER.unpack_from(self.map)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("%s is not a snapshot" % path)
+        view = memoryview(self.map)
+        self.body = view[body_offset:body_offset + body_length]
+        # the index is read straight from the mapped pages, no copy
+        size = self.count * 8
+        self.ids, self.offsets, self.lengths = (
+            view[index_offset + size * column:index_offset + size * (column + 1)].cast("q") for column in range(3)
+        )
+
+    def rows(self, start, stop):
+        # the encoded rows start..stop-1, without the brackets
+        if start >= stop:
+            return b""
+        return self.body[self.offsets[start]:self.offsets[stop - 1] + self.lengths[stop - 1]]
+
+class SharedSnapshots:
+
+    def __init__(self, directory, models):
+        self.directory = directory
+        self.models = models
+        self.enabled = bool(directory)
+        self.app = None
+        self.mapped = {}
+        # model -> time of the last write not in a file yet; the entry goes away once a build that started after it is done
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        from cache import on_invalidate
+        self.app = app
+        os.makedirs(self.directory, exist_ok=True)
+        on_invalidate(self.invalidate)
+
+        @app.before_request
+        def serve_from_snapshot():
+            return self.response()
+
+    def invalidate(self, table):
+        for model in self.models:
+            if model.__tablename__ == table:
+                if running_command():
+                    # the command exits before a build would be done: it removes the file, the workers build it again on their next read
+                    self.discard(table)
+                else:
+                    self.mark_dirty(model)
+
+    def discard(self, table):
+        for model in self.models:
+            if model.__tablename__ == table:
+                try:
+                    os.unlink(snapshot_path(self.directory, model))
+                except FileNotFoundError:
+                    pass
+
+    def mark_dirty(self, model):
+        with self.lock:
+            self.dirty[model] = time.time_ns()
+        self.ensure_started()
+        self.wakeup.set()
+
+    def ensure_started(self):
+        # started on first use, a thread does not survive the fork of the gunicorn workers
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name="shared-snapshots", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                pending = dict(self.dirty)
+            for model, written_at in pending.items():
+                try:
+                    self.build(model, written_at)
+                except Exception:
+                    # answered from the database until the next write tries again
+                    self.app.logger.exception("could not build the %s snapshot", model.__tablename__)
+                    continue
+                with self.lock:
+                    if self.dirty.get(model) == written_at:
+                        del self.dirty[model]
+
+    def build(self, model, written_at):
+        path = snapshot_path(self.directory, model)
+        # one builder at a time across the workers; a write that comes meanwhile triggers another build
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if read_version(path) > written_at:
+                # another worker built it while we waited for the lock
+                return
+            with self.app.app_context():
+                write_snapshot(path, model, self.app.json.dumps)
+
+    def current(self, model):
+        if model in self.dirty:
+            if self.pid != os.getpid():
+                # marked before a fork, the builder thread stayed in the parent
+                self.ensure_started()
+                self.wakeup.set()
+            return None
+        path = snapshot_path(self.directory, model)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # first start, or removed by a flask command
+            self.mark_dirty(model)
+            return None
+        mapped = self.mapped.get(model)
+        if mapped is None or mapped.key != (stat.st_ino, stat.st_mtime_ns):
+            mapped = self.mapped[model] = MappedSnapshot(path)
+        return mapped
+
+    def response(self):
+        target = SNAPSHOT_ENDPOINTS.get(request.endpoint)
+        if target is None or request.method not in ("GET", "HEAD"):
+            return None
+        model, one = target
+        if set(request.args) - {"limit", "after"} or wants_stream():
+            return None
+        snapshot = self.current(model)
+        if snapshot is None:
+            return None
+        if one:
+            start = bisect_left(snapshot.ids, request.view_args["id"])
+            if start == snapshot.count or snapshot.ids[start] != request.view_args["id"]:
+                return None
+            stop = start + 1
+            body = snapshot.rows(start, stop)
+        elif is_paginated_request():
+            limit, after, order_by = get_page_params(model)
+            start = bisect_right(snapshot.ids, after) if after is not None else 0
+            stop = min(start + limit, snapshot.count)
+            next_cursor = snapshot.ids[stop - 1] if stop < snapshot.count else None
+            # same keys and order as page_body() with sorted keys
+            body = b'{"next":%s,"results":[%s]}' % (b"null" if next_cursor is None else b"%d" % next_cursor,
+                snapshot.rows(start, stop))
+        else:
+            start, stop = 0, snapshot.count
+            body = snapshot.body
+        # a copy of the mapped bytes (the WSGI servers want bytes), nothing is encoded
+        response = Response(bytes(body), mimetype="application/json")
+        response.set_etag("%s-%d-%d-%d" % (model.__tablename__, snapshot.version, start, stop))
+        return response.make_conditional(request)
+
+shared_snapshots = SharedSnapshots(SHARED_SNAPSHOT_DIR, (Characters, Planets))
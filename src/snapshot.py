@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from flask import request
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Characters, Planets
+from cache import response_cache
+from replicas import primary_reads
+from boot import running_command
+from utils import get_fields, get_page_params, is_paginated_request
+
+# optional in-memory copy of the reference data (characters, planets)
+#   REFERENCE_SNAPSHOT=1              /people, /planets and /people/<id>, /planets/<id> are answered from memory
+#   REFERENCE_SNAPSHOT_MAX_AGE=60     seconds before a worker reloads it even if it saw no write
+# the copy is columnar: one array('q') per integer column, one list per text column with the repeated
+# values (gender, colors...) sharing the same str object, so 1M rows are a few arrays instead of
+# 1M ORM objects or dicts. A write bumps the table version (cache.invalidate) and the next read
+# reloads it; other workers see the new version with a shared cache (redis) or after MAX_AGE.
+# Only ?fields=, ?limit= and ?after= are answered from memory, filters and sorting go to the database.
+REFERENCE_SNAPSHOT = os.getenv("REFERENCE_SNAPSHOT", "0") == "1"
+REFERENCE_SNAPSHOT_MAX_AGE = float(os.getenv("REFERENCE_SNAPSHOT_MAX_AGE", 60))
+SNAPSHOT_ARGS = {"fields", "limit", "after"}
+LOAD_CHUNK_SIZE = 10000
+
+class ColumnarTable:
+    __slots__ = ("columns", "ids", "version", "loaded_at")
+
+    def __init__(self, model, version):
+        names = model.serialize_columns
+        self.columns = {
+            name: array("q") if getattr(model, name).type.python_type is int else []
+            for name in names
+        }
+        # only while loading, so equal strings end up being one object
+        shared = {name: {} for name in names if not isinstance(self.columns[name], array)}
+        query = db.session.query(*[getattr(model, name) for name in names]).order_by(model.id).yield_per(LOAD_CHUNK_SIZE)
+        for row in query:
+            for name, value in zip(names, row):
+                if name in shared:
+                    value = shared[name].setdefault(value, value)
+                self.columns[name].append(value)
+        self.ids = self.columns["id"]
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, id):
+        index = bisect_left(self.ids, id)
+        if index < len(self.ids) and self.ids[index] == id:
+            return index
+        return None
+
+    def rows(self, start, stop, fields):
+        columns = [(name, self.columns[name]) for name in fields]
+        return [{name: column[index] for name, column in columns} for index in range(start, stop)]
+
+class ReferenceSnapshot:
+
+    def __init__(self, models, enabled, max_age):
+        self.models = models
+        self.enabled = enabled
+        self.max_age = max_age
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        if not self.enabled or running_command():
+            return
+        with app.app_context():
+            try:
+                for model in self.models:
+                    self.reload(model)
+            except SQLAlchemyError:
+                # the database is not migrated yet, the first request loads it
+                db.session.rollback()
+
+    def reload(self, model):
+        version = response_cache.version(model.__tablename__)
+        # kept until the version changes, so it is loaded from the primary
+        with primary_reads():
+            self.tables[model] = ColumnarTable(model, version)
+        return self.tables[model]
+
+    def table(self, model):
+        table = self.tables.get(model)
+        if table is not None:
+            version = response_cache.version(model.__tablename__)
+            if (version is None or version == table.version) and time.monotonic() - table.loaded_at < self.max_age:
+                return table
+        # one request reloads, the others keep using the old copy meanwhile
+        if not self.lock.acquire(blocking=table is None):
+            return table
+        try:
+            if self.tables.get(model) is not table:
+                # another request has just reloaded it
+                return self.tables[model]
+            return self.reload(model)
+        finally:
+            self.lock.release()
+
+    def list_body(self, model):
+        # None when the request needs the database
+        if not self.enabled or set(request.args) - SNAPSHOT_ARGS:
+            return None
+        table = self.table(model)
+        fields = get_fields(model)
+        if not is_paginated_request():
+            return table.rows(0, len(table), fields)
+        limit, after, order_by = get_page_params(model)
+        start = bisect_right(table.ids, after) if after is not None else 0
+        stop = min(start + limit, len(table))
+        return {
+            "results": table.rows(start, stop, fields),
+            "next": table.ids[stop - 1] if stop < len(table) else None,
+        }
+
+    def get_body(self, model, id):
+        if not self.enabled:
+            return None
+        table = self.table(model)
+        index = table.position(id)
+        if index is None:
+            # maybe created after the last reload, the database knows
+            return None
+        return table.rows(index, index + 1, model.serialize_columns)[0]
+
+reference_snapshot = ReferenceSnapshot((Characters, Planets), REFERENCE_SNAPSHOT, REFERENCE_SNAPSHOT_MAX_AGE)
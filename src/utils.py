@@ -1,4 +1,18 @@
-from flask import jsonify, url_for
+import os
+import re
+from flask import jsonify, url_for, request, json, Response, stream_with_context
+
+# keyset pagination: ?limit=N&after=<id>
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 1000
+
+# streaming export: Accept: application/x-ndjson or ?stream=1
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = 1000
+
+# list endpoints select only the serialize() columns as tuples instead of building ORM objects, and
+# responses are encoded with orjson (json_provider.py); FAST_SERIALIZATION=0 turns both off
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "1") == "1"
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +29,150 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_fields(model):
+    # ?fields=name,gender -> only those serialize() columns (the id always comes back, it is the cursor)
+    columns = list(model.serialize_columns)
+    fields = request.args.get("fields")
+    if not fields:
+        return columns
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in columns]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    return ["id"] + [column for column in columns if column in requested and column != "id"]
+
+def apply_filters(model, query):
+    # ?filter[gender]=female&filter[eye_color]=blue -> WHERE gender = ... AND eye_color = ...
+    allowed = getattr(model, "filter_columns", ())
+    for key, value in request.args.items():
+        match = re.fullmatch(r"filter\[(\w+)\]", key)
+        if match is None:
+            continue
+        name = match.group(1)
+        if name not in allowed:
+            raise APIException("Can not filter by '%s'" % name, status_code=400)
+        column = getattr(model, name)
+        if column.type.python_type is int:
+            try:
+                value = int(value)
+            except ValueError:
+                raise APIException("filter[%s] must be an integer" % name, status_code=400)
+        query = query.filter(column == value)
+    return query
+
+def get_order_by(model):
+    # ?sort=-diameter,name -> ORDER BY diameter DESC, name, id; returns the clauses and if it is only by id
+    sort = request.args.get("sort")
+    if not sort:
+        return [model.id], True
+    allowed = getattr(model, "sort_columns", ("id",))
+    clauses = []
+    names = []
+    for field in sort.split(","):
+        field = field.strip()
+        name = field.lstrip("-")
+        if name not in allowed:
+            raise APIException("Can not sort by '%s'" % name, status_code=400)
+        column = getattr(model, name)
+        clauses.append(column.desc() if field.startswith("-") else column.asc())
+        names.append(field)
+    if names == ["id"]:
+        return [model.id], True
+    if "id" not in [name.lstrip("-") for name in names]:
+        clauses.append(model.id)
+    return clauses, False
+
+def serialized_query(model, query=None):
+    if query is None:
+        query = model.query
+    columns = getattr(model, "serialize_columns", None)
+    if columns and (FAST_SERIALIZATION or "fields" in request.args):
+        query = query.with_entities(*[getattr(model, column) for column in get_fields(model)])
+    return apply_filters(model, query)
+
+def sorted_query(model, query=None):
+    order_by, _ = get_order_by(model)
+    return serialized_query(model, query).order_by(*order_by)
+
+def serialize_row(row):
+    # ORM objects know how to serialize themselves, rows from serialized_query() are already the right columns
+    if hasattr(row, "serialize"):
+        return row.serialize()
+    return row._asdict()
+
+def get_int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException("'%s' must be an integer" % name, status_code=400)
+
+def get_bool_arg(name):
+    return request.args.get(name, "").lower() in ("1", "true", "yes")
+
+def is_paginated_request():
+    return "limit" in request.args or "after" in request.args
+
+def get_page_params(model):
+    limit = get_int_arg("limit", PAGE_DEFAULT_LIMIT)
+    after = get_int_arg("after")
+    if limit < 1 or limit > PAGE_MAX_LIMIT:
+        raise APIException("'limit' must be between 1 and %d" % PAGE_MAX_LIMIT, status_code=400)
+    order_by, by_id = get_order_by(model)
+    if not by_id:
+        raise APIException("'sort' can not be combined with 'limit' or 'after', pages are always ordered by id", status_code=400)
+    return limit, after, order_by
+
+def page_body(rows, limit):
+    # rows has one extra row when there is a next page
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return {
+        "results": [serialize_row(row) for row in rows[:limit]],
+        "next": next_cursor,
+    }
+
+def paginate_by_id(model, query=None):
+    # the cursor is the last id returned, so every page is an index range scan on the
+    # primary key no matter how deep the client is in the table (no OFFSET)
+    limit, after, order_by = get_page_params(model)
+    query = serialized_query(model, query)
+    if after is not None:
+        query = query.filter(model.id > after)
+    # ask for one extra row to know if there is a next page
+    rows = query.order_by(*order_by).limit(limit + 1).all()
+    return page_body(rows, limit)
+
+def wants_stream():
+    if get_bool_arg("stream"):
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_ndjson(model, query=None, chunk_size=STREAM_CHUNK_SIZE):
+    # yield_per fetches the rows in chunks (server-side cursor on postgres) and we write
+    # every chunk as soon as it is encoded, so memory does not grow with the table
+    order_by, by_id = get_order_by(model)
+    query = serialized_query(model, query)
+    after = get_int_arg("after")
+    if after is not None:
+        if not by_id:
+            raise APIException("'sort' can not be combined with 'after'", status_code=400)
+        query = query.filter(model.id > after)
+    query = query.order_by(*order_by).yield_per(chunk_size)
+
+    def generate():
+        lines = []
+        for row in query:
+            lines.append(json.dumps(serialize_row(row)))
+            if len(lines) >= chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
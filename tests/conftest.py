@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# the app reads its configuration from the environment when it is imported
+DATABASE_DIR = tempfile.mkdtemp(prefix="swapi-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(DATABASE_DIR, "test.db")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def app():
+    from app import app
+    from models import db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    # the id of one user, for the tests that need someone to own favorites or to export
+    from models import db, User
+    with app.app_context():
+        user = User(name="Leia", lastname="Organa", email="leia@rebels.test", password="secret", is_active=True)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
@@ -0,0 +1,44 @@
+import pytest
+from models import db, Characters, Fav_Characters, Popular_Characters
+
+
+@pytest.fixture
+def ids(app, user):
+    with app.app_context():
+        characters = [Characters(name=name, birthday_year=19, gender="male", height=172, skin_color="fair",
+            eye_color="blue") for name in ("Luke Skywalker", "Han Solo")]
+        db.session.add_all(characters)
+        db.session.commit()
+        return user, [character.id for character in characters]
+
+
+def counters(app):
+    with app.app_context():
+        return {row.character_id: row.favorites for row in Popular_Characters.query if row.favorites}
+
+
+def dashboard_characters(client, user_id):
+    body = client.get("/user/%d/dashboard" % user_id).get_json()
+    return [favorite["character_id"] for favorite in body["fav_characters"]]
+
+
+def test_admin_favorites_update_counters_and_dashboards(app, client, ids):
+    user_id, (luke, han) = ids
+    assert dashboard_characters(client, user_id) == []
+
+    response = client.post("/admin/fav_characters/new/", data={"user": user_id, "character": luke})
+    assert response.status_code == 302
+    assert counters(app) == {luke: 1}
+    assert dashboard_characters(client, user_id) == [luke]
+
+    with app.app_context():
+        favorite_id = Fav_Characters.query.one().id
+    response = client.post("/admin/fav_characters/edit/?id=%d" % favorite_id, data={"user": user_id, "character": han})
+    assert response.status_code == 302
+    assert counters(app) == {han: 1}
+    assert dashboard_characters(client, user_id) == [han]
+
+    response = client.post("/admin/fav_characters/delete/", data={"id": favorite_id})
+    assert response.status_code == 302
+    assert counters(app) == {}
+    assert dashboard_characters(client, user_id) == []
@@ -0,0 +1,106 @@
+import fakeredis
+import pytest
+from flask import Flask, jsonify
+import cache
+from cache import RedisBackend, ResponseCache, cached_response
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def shared_cache(server):
+    # what every gunicorn worker builds from RESPONSE_CACHE_URL=redis://...
+    return ResponseCache(RedisBackend(fakeredis.FakeRedis(server=server), ttl=60))
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(calls):
+    app = Flask(__name__)
+
+    @app.route("/things")
+    @cached_response("things")
+    def things():
+        calls.append(1)
+        return jsonify(["tie fighter", "x-wing"])
+
+    return app.test_client()
+
+
+def test_a_version_bump_is_seen_by_every_worker(server):
+    worker, other_worker = shared_cache(server), shared_cache(server)
+    version = worker.version("things")
+    assert other_worker.version("things") == version
+    worker.set("things", version, "/things?", (b"[]", "etag", "application/json"))
+    assert other_worker.get("things", version, "/things?") == (b"[]", "etag", "application/json")
+    worker.invalidate("things")
+    assert other_worker.version("things") == worker.version("things") != version
+    assert other_worker.get("things", other_worker.version("things"), "/things?") is None
+
+
+def test_a_304_is_served_from_the_entry_of_another_worker(server, client, calls, monkeypatch):
+    monkeypatch.setattr(cache, "response_cache", shared_cache(server))
+    first = client.get("/things")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    monkeypatch.setattr(cache, "response_cache", shared_cache(server))
+    second = client.get("/things", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert calls == [1]
+
+
+def test_the_cache_is_bypassed_while_the_server_is_down(server, client, calls, monkeypatch):
+    shared = shared_cache(server)
+    monkeypatch.setattr(cache, "response_cache", shared)
+    client.get("/things")
+    server.connected = False
+    assert shared.version("things") is None
+    for request in range(2):
+        response = client.get("/things")
+        assert response.status_code == 200
+        assert response.get_json() == ["tie fighter", "x-wing"]
+    # both went to the view, nothing was read from or written to the cache
+    assert calls == [1, 1, 1]
+    server.connected = True
+    client.get("/things")
+    assert calls == [1, 1, 1]
+
+
+
+def memory_backend(server):
+    # room for two counters, invalidating two other dashboards evicts the first one
+    backend = cache.MemoryBackend(16, 60, max_counters=2)
+
+    def lose(key):
+        backend.incr("version:dashboard:2")
+        backend.incr("version:dashboard:3")
+    return backend, lose
+
+
+def redis_backend(server):
+    client = fakeredis.FakeRedis(server=server)
+
+    def lose(key):
+        # what the expiry of the counter does
+        client.delete("swapi:version:" + key)
+    return RedisBackend(client, ttl=60), lose
+
+
+@pytest.mark.parametrize("make_backend", [memory_backend, redis_backend])
+def test_a_lost_version_never_comes_back(server, make_backend):
+    backend, lose = make_backend(server)
+    versions = ResponseCache(backend)
+    before = versions.version("dashboard:1")
+    versions.invalidate("dashboard:1")
+    after = versions.version("dashboard:1")
+    lose("dashboard:1")
+    # an entry cached under an older version can not be served again, the read is only a miss
+    assert versions.version("dashboard:1") not in (before, after)
@@ -0,0 +1,26 @@
+import json
+from models import db, User
+
+
+def test_export_leaves_the_passwords_out(app, user, tmp_path):
+    path = tmp_path / "users.csv"
+    result = app.test_cli_runner().invoke(args=["catalog", "export", "users", str(path)])
+    assert result.exit_code == 0, result.output
+    header, row = path.read_text().splitlines()
+    assert header == "id,name,lastname,email,is_active"
+    assert "secret" not in row
+
+
+def test_export_with_passwords_imports_back(app, user, tmp_path):
+    path = tmp_path / "users.ndjson"
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["catalog", "export", "users", str(path), "--with-passwords"])
+    assert result.exit_code == 0, result.output
+    assert json.loads(path.read_text())["password"] == "secret"
+    with app.app_context():
+        User.query.delete()
+        db.session.commit()
+    result = runner.invoke(args=["catalog", "import", "users", str(path), "--workers", "1"])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert User.query.one().password == "secret"
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from models import db, Characters, Planets, Fav_Characters, Fav_Planets
+
+
+@contextmanager
+def count_statements(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def add_favorites(app, user_id, favorites):
+    # <favorites> new characters and planets, all favorites of the user
+    with app.app_context():
+        first = Characters.query.count()
+        for index in range(first, first + favorites):
+            character = Characters(name="Character %d" % index, birthday_year=index, gender="n/a", height=100,
+                skin_color="fair", eye_color="brown")
+            planet = Planets(name="Planet %d" % index, diameter=index, rotation_period=24, orbital_period=365)
+            db.session.add_all([character, planet])
+            db.session.flush()
+            db.session.add(Fav_Characters(user_id=user_id, character_id=character.id))
+            db.session.add(Fav_Planets(user_id=user_id, planet_id=planet.id))
+        db.session.commit()
+
+
+@pytest.mark.parametrize("path", ["fav_characters", "fav_planets"])
+@pytest.mark.parametrize("expand", ["", "?expand=1"])
+def test_favorites_statements_do_not_grow_with_the_favorites(app, client, user, path, expand):
+    counts = {}
+    added = 0
+    for favorites in (1, 25):
+        add_favorites(app, user, favorites - added)
+        added = favorites
+        with count_statements(app) as statements:
+            response = client.get("/user/%d/%s%s" % (user, path, expand))
+        assert response.status_code == 200
+        assert len(response.get_json()) == favorites
+        counts[favorites] = len(statements)
+    # the user and the favorites (joined with their character/planet when expanded)
+    assert counts == {1: 2, 25: 2}
+
+
+def test_expanded_favorites_include_the_character(app, client, user):
+    add_favorites(app, user, 3)
+    body = client.get("/user/%d/fav_characters?expand=1" % user).get_json()
+    assert [favorite["character"]["name"] for favorite in body] == ["Character 0", "Character 1", "Character 2"]
+
+
+@pytest.mark.parametrize("error", [
+    OperationalError("INSERT", {}, Exception("database is locked")),
+    RuntimeError("a bug in the writer thread"),
+])
+def test_group_commit_failure_answers_503(app, client, user, monkeypatch, error):
+    import group_commit
+
+    def apply_favorite_writes(writes):
+        raise error
+
+    add_favorites(app, user, 1)
+    monkeypatch.setattr(group_commit.favorites_group_commit, "enabled", True)
+    monkeypatch.setattr(group_commit, "apply_favorite_writes", apply_favorite_writes)
+    response = client.post("/user/%d/fav_characters" % user, json={"id_character": 1})
+    assert response.status_code == 503
+    assert response.get_json() == {"msg": "ko"}
@@ -0,0 +1,28 @@
+from flask import Flask
+import metrics
+import ratelimit
+from models import db
+
+
+def test_rejections_are_counted_in_the_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "request_metrics", metrics.RequestMetrics())
+    monkeypatch.setattr(ratelimit, "rate_limiter",
+        ratelimit.RateLimiter({"ping": (1, 1)}, {}, None, ratelimit.MemoryBackend(10)))
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+
+    @app.route("/ping")
+    def ping():
+        return "pong"
+
+    # the same order as app.py: the limits first
+    ratelimit.setup_rate_limits(app)
+    metrics.setup_metrics(app)
+    client = app.test_client()
+    assert client.get("/ping").status_code == 200
+    assert client.get("/ping").status_code == 429
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'rate_limited_total{endpoint="ping",method="GET",status="429"} 1' in body
+    assert 'http_responses_total{endpoint="ping",method="GET",status="200"} 1' in body
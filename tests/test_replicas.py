@@ -0,0 +1,30 @@
+from flask import Flask
+import cache
+from replicas import primary_reads, reads_from_primary
+
+
+def test_primary_reads_inside_a_get(app):
+    with app.test_request_context("/people"):
+        assert not reads_from_primary()
+        with primary_reads():
+            assert reads_from_primary()
+        assert not reads_from_primary()
+
+
+def test_cache_fills_read_the_primary(monkeypatch):
+    monkeypatch.setattr(cache, "DATABASE_REPLICA_URLS", ["sqlite:////tmp/replica.db"])
+    monkeypatch.setattr(cache, "response_cache", cache.ResponseCache(cache.MemoryBackend(16, 60)))
+    app = Flask(__name__)
+    fills = []
+
+    @app.route("/people")
+    @cache.cached_response("characters")
+    def people():
+        fills.append(reads_from_primary())
+        return {"results": []}
+
+    client = app.test_client()
+    assert client.get("/people").status_code == 200
+    assert client.get("/people").status_code == 200
+    # the second one is answered from the entry the first one stored
+    assert fills == [True]
@@ -0,0 +1,49 @@
+import os
+import click
+import pytest
+from flask import Flask
+import cache
+from models import db, Characters
+from shared_snapshot import SharedSnapshots, snapshot_path
+
+
+@pytest.fixture
+def snapshots(app, tmp_path, monkeypatch):
+    # an app as `flask run` builds it, with /people and the characters snapshot in tmp_path
+    monkeypatch.setenv("FLASK_RUN_FROM_CLI", "true")
+    monkeypatch.setattr(cache, "invalidate_listeners", [])
+    server = Flask(__name__)
+    server.config.update(app.config)
+    db.init_app(server)
+
+    @server.route("/people", endpoint="get_characters")
+    def people():
+        return {"from": "database"}
+
+    snapshots = SharedSnapshots(str(tmp_path), (Characters,))
+    snapshots.init_app(server)
+    with server.app_context():
+        db.session.add(Characters(name="Luke Skywalker", birthday_year=19, gender="male", height=172,
+            skin_color="fair", eye_color="blue"))
+        db.session.commit()
+        snapshots.build(Characters, 0)
+    return server, snapshots
+
+
+def test_flask_run_answers_from_the_snapshot(snapshots):
+    server, snapshots = snapshots
+    response = server.test_client().get("/people")
+    assert response.status_code == 200
+    assert [row["name"] for row in response.get_json()] == ["Luke Skywalker"]
+
+
+def test_only_a_command_removes_the_snapshot(snapshots, monkeypatch):
+    server, snapshots = snapshots
+    monkeypatch.setattr(snapshots, "ensure_started", lambda: None)
+    path = snapshot_path(snapshots.directory, Characters)
+    # a write in a request of `flask run` has the file built again, it stays there meanwhile
+    cache.invalidate("characters")
+    assert Characters in snapshots.dirty and os.path.exists(path)
+    with click.Context(click.Command("import")):
+        cache.invalidate("characters")
+    assert not os.path.exists(path)